@@ -0,0 +1,489 @@
+#!/usr/bin/env python3
+"""
+Benchmark de browser_controller contra un servidor local de fixtures.
+
+Sirve páginas estáticas (tabla grande, feed con scroll infinito y formulario extenso)
+desde http.server y mide arranque en frío del navegador, latencia por acción del
+mapa de execute_action, throughput de recipes y RSS máximo. La sección startup
+mide el CLI en los comandos de recipes, que no deben cargar el navegador. Los
+resultados se guardan como baseline JSON y se pueden comparar contra uno anterior.
+"""
+
+import argparse
+import asyncio
+import functools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional, Dict, Any, List, Callable
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import browser_controller as bc
+
+
+# Métricas donde un valor mayor es mejor (el resto: menor es mejor)
+HIGHER_IS_BETTER = {"items_per_s"}
+
+
+# ==================== FIXTURES ====================
+
+def _table_page(rows: int) -> str:
+    body = "\n".join(
+        f'<tr data-id="{i}"><td class="name"><a href="/item/{i}">Item {i}</a></td>'
+        f'<td class="price">{i * 3 % 997}.{i % 100:02d}</td>'
+        f'<td class="tags"><span class="tag">t{i % 7}</span><span class="tag">t{i % 11}</span></td></tr>'
+        for i in range(rows)
+    )
+    return f"""<!DOCTYPE html>
+<html><head><title>Tabla</title></head><body>
+<h1>Tabla de {rows} filas</h1>
+<table id="data"><thead><tr><th>Nombre</th><th>Precio</th><th>Etiquetas</th></tr></thead>
+<tbody>
+{body}
+</tbody></table>
+</body></html>"""
+
+
+def _feed_page(batch: int) -> str:
+    return f"""<!DOCTYPE html>
+<html><head><title>Feed</title>
+<style>.post {{ height: 120px; border-bottom: 1px solid #ccc; }}</style></head><body>
+<h1>Feed</h1>
+<div id="feed"></div>
+<div id="sentinel">cargando...</div>
+<script>
+let next = 0;
+function load() {{
+    const feed = document.getElementById('feed');
+    for (let i = 0; i < {batch}; i++, next++) {{
+        const post = document.createElement('article');
+        post.className = 'post';
+        post.dataset.id = next;
+        post.textContent = 'Post ' + next;
+        feed.appendChild(post);
+    }}
+}}
+load();
+new IntersectionObserver(entries => {{
+    if (entries.some(e => e.isIntersecting)) setTimeout(load, 50);
+}}).observe(document.getElementById('sentinel'));
+</script>
+</body></html>"""
+
+
+def _form_page(fields: int) -> str:
+    inputs = "\n".join(
+        f'<label>Campo {i} <input id="field-{i}" name="field-{i}" type="text"></label>'
+        for i in range(fields)
+    )
+    return f"""<!DOCTYPE html>
+<html><head><title>Formulario</title></head><body>
+<h1>Formulario</h1>
+<form id="form" onsubmit="event.preventDefault(); document.getElementById('status').textContent = 'enviado';">
+{inputs}
+<select id="country"><option value="ar">Argentina</option><option value="es">España</option><option value="mx">México</option></select>
+<label><input id="terms" type="checkbox"> Acepto</label>
+<button id="submit" type="submit">Enviar</button>
+</form>
+<p id="status"></p>
+</body></html>"""
+
+
+class FixtureServer:
+    """Servidor HTTP local en un hilo de fondo que sirve las páginas de prueba."""
+
+    def __init__(self, rows: int = 2000, feed_batch: int = 20, fields: int = 100):
+        self.directory = tempfile.mkdtemp(prefix="browser-bench-")
+        pages = {
+            "table.html": _table_page(rows),
+            "feed.html": _feed_page(feed_batch),
+            "form.html": _form_page(fields),
+        }
+        for filename, html in pages.items():
+            with open(os.path.join(self.directory, filename), 'w', encoding='utf-8') as f:
+                f.write(html)
+
+        handler = functools.partial(_QuietHandler, directory=self.directory)
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def url(self, page: str) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/{page}"
+
+    def __enter__(self) -> 'FixtureServer':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+# ==================== MEDICIÓN ====================
+
+class RssSampler:
+    """Muestrea en segundo plano el RSS del árbol de procesos y guarda el máximo."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak_kb = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self.supported = os.path.isdir("/proc/self")
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak_kb = max(self.peak_kb, bc._process_tree_rss_kb(os.getpid()) or 0)
+            self._stop.wait(self.interval)
+
+    def __enter__(self) -> 'RssSampler':
+        if self.supported:
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        if self.supported:
+            self._thread.join()
+        else:
+            import resource
+            self.peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+def _stats(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "n": len(ordered),
+        "min_ms": round(ordered[0], 2),
+        "median_ms": round(statistics.median(ordered), 2),
+        "p95_ms": round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 2),
+        "mean_ms": round(statistics.fmean(ordered), 2),
+    }
+
+
+# ==================== ESCENARIOS ====================
+
+def _action_cases(server: FixtureServer, workdir: str) -> List[Dict[str, Any]]:
+    """Casos de latencia: página donde se prepara y acción (con params) a repetir."""
+    table, feed, form = server.url("table.html"), server.url("feed.html"), server.url("form.html")
+    return [
+        {"page": table, "action": "navigate", "params": {"url": table}},
+        {"page": table, "action": "navigate", "name": "navigate_networkidle",
+         "params": {"url": table, "wait_until": "networkidle"}},
+        {"page": table, "action": "reload", "params": {}},
+        {"page": table, "action": "get_text", "params": {"selector": "h1"}},
+        {"page": table, "action": "get_html", "params": {"selector": "h1"}},
+        {"page": table, "action": "get_attribute", "params": {"selector": "#data tbody tr", "attribute": "data-id"}},
+        {"page": table, "action": "get_elements", "params": {"selector": "#data tbody tr", "limit": 500}},
+        {"page": table, "action": "extract", "params": {"schema": {
+            "row": "#data tbody tr",
+            "fields": {"name": "td.name", "price": "td.price", "id": {"attribute": "data-id"},
+                       "tags": {"selector": ".tag", "all": True}}
+        }}},
+        {"page": table, "action": "evaluate", "params": {"script": "document.querySelectorAll('tr').length"}},
+        {"page": table, "action": "wait_for_selector", "params": {"selector": "#data"}},
+        {"page": table, "action": "screenshot", "params": {"dir": workdir}},
+        {"page": table, "action": "scroll_to_element", "params": {"selector": "#data tbody tr:last-child"}},
+        {"page": table, "action": "list_tabs", "params": {}},
+        {"page": table, "action": "set_viewport", "params": {"width": 1280, "height": 800}},
+        {"page": feed, "action": "scroll", "params": {"direction": "down", "amount": 2000}},
+        {"page": form, "action": "fill", "params": {"selector": "#field-50", "text": "benchmark"}},
+        {"page": form, "action": "type", "params": {"selector": "#field-1", "text": "abc", "delay": 0}},
+        {"page": form, "action": "clear", "params": {"selector": "#field-50"}},
+        {"page": form, "action": "press_key", "params": {"key": "Tab"}},
+        {"page": form, "action": "hover", "params": {"selector": "#submit"}},
+        {"page": form, "action": "focus", "params": {"selector": "#field-10"}},
+        {"page": form, "action": "select_option", "params": {"selector": "#country", "value": "es"}},
+        {"page": form, "action": "check", "params": {"selector": "#terms"}},
+        {"page": form, "action": "click", "params": {"selector": "#submit"}},
+    ]
+
+
+# Módulos que los comandos de recipes no deben importar (se cargan bajo demanda)
+LAZY_MODULES = ("asyncio", "multiprocessing", "playwright")
+
+
+async def bench_startup(args) -> Dict[str, Any]:
+    """Arranque del CLI en los comandos de recipes y módulos pesados cargados al importar."""
+    script = os.path.abspath(bc.__file__)
+    env = dict(os.environ, BROWSER_CONTROLLER_RECIPES=bc.RECIPES_DIR)
+    commands = {
+        "create_recipe": ["--create-recipe", "bench-startup", "--steps", "[]"],
+        "show_recipe": ["--show-recipe", "bench-startup"],
+        "list_recipes": ["--list-recipes"],
+    }
+    report = {}
+    for name, argv in commands.items():
+        samples = []
+        for _ in range(args.iterations):
+            started = time.perf_counter()
+            completed = subprocess.run([sys.executable, script, *argv], env=env, capture_output=True)
+            samples.append((time.perf_counter() - started) * 1000)
+            if completed.returncode != 0:
+                raise RuntimeError(completed.stdout.decode() or completed.stderr.decode())
+        report[name] = _stats(samples)
+
+    probe = (f"import sys, json; sys.path.insert(0, {os.path.dirname(script)!r}); import browser_controller; "
+             f"print(json.dumps([m for m in {list(LAZY_MODULES)!r} "
+             f"if type(sys.modules.get(m)).__name__ == 'module']))")
+    loaded = json.loads(subprocess.run([sys.executable, "-c", probe], env=env, capture_output=True,
+                                       check=True).stdout)
+    report["eager_modules"] = loaded
+    report["budget_ms"] = args.startup_budget
+    report["over_budget"] = sorted(name for name in commands if report[name]["median_ms"] > args.startup_budget)
+    return report
+
+
+async def bench_cold_start(args) -> Dict[str, Any]:
+    """Tiempo de start() (lanzar navegador + contexto + página) y de stop()."""
+    start_samples, stop_samples = [], []
+    for _ in range(args.cold_starts):
+        engine = bc.AsyncBrowserController(headless=True, browser_type=args.browser)
+        started = time.perf_counter()
+        result = await engine.start()
+        start_samples.append((time.perf_counter() - started) * 1000)
+        if not result.success:
+            raise RuntimeError(result.error)
+        started = time.perf_counter()
+        await engine.stop()
+        stop_samples.append((time.perf_counter() - started) * 1000)
+    return {"start": _stats(start_samples), "stop": _stats(stop_samples)}
+
+
+async def bench_actions(args, server: FixtureServer, workdir: str) -> Dict[str, Any]:
+    """Latencia de cada acción del mapa de execute_action sobre un motor ya caliente."""
+    engine = bc.AsyncBrowserController(headless=True, browser_type=args.browser)
+    result = await engine.start()
+    if not result.success:
+        raise RuntimeError(result.error)
+
+    report = {}
+    try:
+        for case in _action_cases(server, workdir):
+            name = case.get("name", case["action"])
+            if args.actions and name not in args.actions:
+                continue
+            await engine.execute_action("navigate", {"url": case["page"], "wait_until": "load"})
+            samples, errors = [], 0
+            for _ in range(args.iterations):
+                started = time.perf_counter()
+                result = await engine.execute_action(case["action"], case["params"])
+                samples.append((time.perf_counter() - started) * 1000)
+                if not result.success:
+                    errors += 1
+            report[name] = dict(_stats(samples), errors=errors)
+    finally:
+        await engine.stop()
+    return report
+
+
+def _bench_recipe_steps(server: FixtureServer) -> List[Dict[str, Any]]:
+    return [
+        {"action": "navigate", "params": {"url": server.url("form.html"), "ready_selector": "#form"}},
+        {"action": "fill", "params": {"selector": "#field-0", "text": "{{name}}"}},
+        {"action": "fill", "params": {"selector": "#field-1", "text": "{{email}}"}},
+        {"action": "select_option", "params": {"selector": "#country", "value": "{{country}}"}},
+        {"action": "check", "params": {"selector": "#terms"}},
+        {"action": "click", "params": {"selector": "#submit"}},
+        {"action": "get_text", "params": {"selector": "#status"}},
+        {"action": "navigate", "params": {"url": server.url("table.html")}},
+        {"action": "get_elements", "params": {"selector": "#data tbody tr", "limit": 50}},
+    ]
+
+
+async def bench_recipes(args, server: FixtureServer) -> Dict[str, Any]:
+    """Throughput de run_recipe secuencial y de run_batch con varios workers."""
+    create_result = bc.RecipeManager.create_recipe(
+        "bench-form", "Benchmark: formulario + tabla", _bench_recipe_steps(server),
+        {"name": "", "email": "", "country": "ar"}
+    )
+    if not create_result.success:
+        raise RuntimeError(create_result.error)
+    variable_sets = [{"name": f"user {i}", "email": f"user{i}@example.com", "country": ("ar", "es", "mx")[i % 3]}
+                     for i in range(args.items)]
+
+    engine = bc.AsyncBrowserController(headless=True, browser_type=args.browser)
+    result = await engine.start()
+    if not result.success:
+        raise RuntimeError(result.error)
+    samples = []
+    try:
+        for variables in variable_sets[:args.iterations]:
+            started = time.perf_counter()
+            result = await bc.RecipeManager.run_recipe_async("bench-form", variables, engine=engine)
+            samples.append((time.perf_counter() - started) * 1000)
+            if not result.success:
+                raise RuntimeError(result.error)
+    finally:
+        await engine.stop()
+
+    started = time.perf_counter()
+    batch = await bc.RecipeManager.run_batch_async(
+        "bench-form", variable_sets, concurrency=args.concurrency, browser_type=args.browser
+    )
+    elapsed = time.perf_counter() - started
+    return {
+        "run_recipe": _stats(samples),
+        "batch": {
+            "items": len(variable_sets),
+            "concurrency": args.concurrency,
+            "failed": batch.data["failed"] if batch.data else len(variable_sets),
+            "total_ms": round(elapsed * 1000, 2),
+            "items_per_s": round(len(variable_sets) / elapsed, 2),
+        }
+    }
+
+
+async def run_benchmarks(args) -> Dict[str, Any]:
+    """Ejecuta las secciones pedidas y devuelve el reporte completo."""
+    sections: Dict[str, Callable] = {
+        "startup": lambda: bench_startup(args),
+        "cold_start": lambda: bench_cold_start(args),
+        "actions": lambda: bench_actions(args, server, workdir),
+        "recipes": lambda: bench_recipes(args, server),
+    }
+    report = {
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "browser": args.browser,
+        "config": {"iterations": args.iterations, "rows": args.rows, "items": args.items,
+                   "concurrency": args.concurrency},
+        "results": {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix="browser-bench-") as workdir, \
+            FixtureServer(rows=args.rows) as server:
+        # Los recipes del benchmark no deben ensuciar el directorio real
+        recipes_dir, bc.RECIPES_DIR = bc.RECIPES_DIR, os.path.join(workdir, "recipes")
+        os.makedirs(bc.RECIPES_DIR)
+        try:
+            for name in args.only or list(sections):
+                print(f"» {name}", file=sys.stderr, flush=True)
+                with RssSampler() as rss:
+                    report["results"][name] = await sections[name]()
+                report["results"][name]["peak_rss_kb"] = rss.peak_kb
+        finally:
+            bc.RECIPES_DIR = recipes_dir
+    return report
+
+
+# ==================== COMPARACIÓN ====================
+
+def _flatten(data: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in data.items():
+        path = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(_flatten(value, path))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[path] = value
+    return flat
+
+
+def compare(baseline: Dict[str, Any], current: Dict[str, Any], threshold: float = 0.10) -> Dict[str, Any]:
+    """
+    Compara dos reportes métrica a métrica.
+
+    Sólo se evalúan medianas, p95, throughput y RSS; una métrica es regresión si
+    empeora más que threshold (fracción) respecto del baseline.
+    """
+    old, new = _flatten(baseline.get("results", {})), _flatten(current.get("results", {}))
+    tracked = ("median_ms", "p95_ms", "items_per_s", "peak_rss_kb", "total_ms")
+    rows, regressions = [], []
+    for metric in sorted(old.keys() & new.keys()):
+        if not metric.endswith(tracked) or not old[metric]:
+            continue
+        change = (new[metric] - old[metric]) / old[metric]
+        worse = -change if metric.rsplit(".", 1)[-1] in HIGHER_IS_BETTER else change
+        row = {"metric": metric, "baseline": old[metric], "current": new[metric],
+               "change_pct": round(change * 100, 1), "regression": worse > threshold}
+        rows.append(row)
+        if row["regression"]:
+            regressions.append(metric)
+    return {"threshold_pct": threshold * 100, "metrics": rows, "regressions": regressions}
+
+
+def _print_comparison(comparison: Dict[str, Any]):
+    for row in comparison["metrics"]:
+        flag = "  REGRESIÓN" if row["regression"] else ""
+        print(f'{row["metric"]:<55} {row["baseline"]:>12} → {row["current"]:>12} '
+              f'({row["change_pct"]:+.1f}%){flag}', file=sys.stderr)
+    print(f'{len(comparison["regressions"])} regresiones (umbral {comparison["threshold_pct"]:.0f}%)',
+          file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark de browser_controller contra fixtures locales",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Ejemplos:
+  # Guardar baseline
+  python benchmark.py --output baseline.json
+
+  # Comparar contra el baseline (sale con 1 si hay regresiones)
+  python benchmark.py --compare baseline.json --output actual.json
+
+  # Sólo latencias de algunas acciones
+  python benchmark.py --only actions --action get_elements --action extract
+
+  # Presupuesto de arranque de los comandos de recipes (no requiere Playwright)
+  python benchmark.py --only startup --startup-budget 200
+        """
+    )
+    parser.add_argument("--only", action="append", choices=["startup", "cold_start", "actions", "recipes"],
+                        help="Secciones a ejecutar (repetible, por defecto todas)")
+    parser.add_argument("--action", dest="actions", action="append", help="Limitar latencias a estas acciones")
+    parser.add_argument("--iterations", type=int, default=20, help="Repeticiones por acción y por recipe")
+    parser.add_argument("--cold-starts", type=int, default=5, help="Arranques en frío a medir")
+    parser.add_argument("--rows", type=int, default=2000, help="Filas de la tabla fixture")
+    parser.add_argument("--items", type=int, default=40, help="Items del lote de recipes")
+    parser.add_argument("--concurrency", type=int, default=4, help="Workers del lote de recipes")
+    parser.add_argument("--browser", default="chromium", choices=["chromium", "firefox", "webkit"])
+    parser.add_argument("--startup-budget", type=float, default=250.0,
+                        help="Mediana máxima en ms de los comandos de recipes (sección startup)")
+    parser.add_argument("--output", "-o", help="Archivo JSON donde guardar los resultados")
+    parser.add_argument("--compare", help="Baseline JSON contra el que comparar")
+    parser.add_argument("--threshold", type=float, default=10.0, help="Umbral de regresión en %%")
+    args = parser.parse_args()
+
+    if set(args.only or ["all"]) != {"startup"} and not bc.PLAYWRIGHT_AVAILABLE:
+        print(json.dumps({"success": False, "error": "Playwright no está instalado. Ejecuta: pip install playwright && playwright install"}))
+        sys.exit(1)
+
+    report = asyncio.run(run_benchmarks(args))
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            report["comparison"] = compare(json.load(f), report, args.threshold / 100)
+        _print_comparison(report["comparison"])
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    startup = report["results"].get("startup", {})
+    if startup.get("over_budget") or startup.get("eager_modules"):
+        print(f'Arranque fuera de presupuesto ({args.startup_budget:.0f} ms): '
+              f'{startup["over_budget"]}, módulos cargados: {startup["eager_modules"]}', file=sys.stderr)
+    failed = report.get("comparison", {}).get("regressions") or startup.get("over_budget") or startup.get("eager_modules")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
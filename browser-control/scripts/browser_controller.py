@@ -6,25 +6,554 @@ Incluye sistema de Recipes (recetas) para automatizaciones reutilizables.
 """
 
 import argparse
+import csv
 import json
 import base64
 import sys
 import os
 import re
-from typing import Optional, Dict, Any, List
-from dataclasses import dataclass, asdict
+import socket
+import selectors
+import tempfile
+import threading
+import time
+import bisect
+import fnmatch
+import hashlib
+import hmac
+import queue
+import importlib.util
+from functools import lru_cache
+from urllib.parse import urlsplit
+from typing import Optional, Dict, Any, List, Callable, TYPE_CHECKING
+from dataclasses import dataclass
 from datetime import datetime
 
-# Importaciones condicionales para manejar la falta de playwright
-try:
-    from playwright.sync_api import sync_playwright, Page, Browser, BrowserContext
-    PLAYWRIGHT_AVAILABLE = True
-except ImportError:
-    PLAYWRIGHT_AVAILABLE = False
 
-# Directorio para almacenar recipes
-RECIPES_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "recipes")
-os.makedirs(RECIPES_DIR, exist_ok=True)
+def _lazy_import(name: str):
+    """
+    Devuelve el módulo sin ejecutarlo hasta el primer acceso a un atributo.
+    
+    Los comandos de recipes (--list-recipes, --show-recipe, --create-recipe) no
+    usan el navegador y así no pagan la importación de asyncio ni multiprocessing.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+asyncio = _lazy_import("asyncio")
+multiprocessing = _lazy_import("multiprocessing")
+
+# Playwright se importa al arrancar el primer navegador (ver AsyncBrowserController.start)
+PLAYWRIGHT_AVAILABLE = importlib.util.find_spec("playwright") is not None
+# tldextract (opcional) da la Public Suffix List completa para no-third-party
+TLDEXTRACT_AVAILABLE = importlib.util.find_spec("tldextract") is not None
+if TYPE_CHECKING:
+    from playwright.async_api import Page, Browser, BrowserContext
+
+# Directorio para almacenar recipes; se crea al guardar el primero
+RECIPES_DIR = os.environ.get(
+    "BROWSER_CONTROLLER_RECIPES",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "recipes")
+)
+
+# Perfiles de sesión (storage_state con cookies y localStorage); se crea al guardar el primero
+SESSIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "sessions")
+SESSION_TTL = 24 * 3600
+
+# Checkpoints de recipes en curso (para --resume)
+CHECKPOINTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "checkpoints")
+
+# Directorio del usuario (0700) con el socket del daemon y, en TCP, su token: en el
+# temporal compartido otro usuario podría crear antes el socket y recibir las peticiones
+DAEMON_DIR = os.path.join(os.environ["XDG_RUNTIME_DIR"], "browser-controller") \
+    if os.environ.get("XDG_RUNTIME_DIR") else os.path.join(os.path.expanduser("~"), ".browser-controller")
+
+# Dirección por defecto del daemon (socket Unix o host:puerto en plataformas sin AF_UNIX)
+DEFAULT_DAEMON_PORT = 47831
+if hasattr(socket, "AF_UNIX"):
+    _default_daemon_address = os.path.join(DAEMON_DIR, "daemon.sock")
+else:
+    _default_daemon_address = f"127.0.0.1:{DEFAULT_DAEMON_PORT}"
+DAEMON_ADDRESS = os.environ.get("BROWSER_CONTROLLER_DAEMON", _default_daemon_address)
+
+# Formatos de screenshot aceptados (alias -> tipo)
+SCREENSHOT_FORMATS = {"png": "png", "jpeg": "jpeg", "jpg": "jpeg", "webp": "webp"}
+
+# Campos extraíbles por get_elements y la función que los recoge en una sola evaluación
+ELEMENT_FIELDS = ("text", "tag", "attributes", "href", "box", "html", "value", "visible")
+EXTRACT_ELEMENTS_JS = """
+(elements, opts) => {
+    const end = opts.limit == null ? elements.length : opts.offset + opts.limit;
+    const items = elements.slice(opts.offset, end).map((el, i) => {
+        const item = {index: opts.offset + i};
+        for (const field of opts.fields) {
+            if (field === 'text') {
+                const text = el.innerText || el.textContent || '';
+                item.text = opts.maxText ? text.slice(0, opts.maxText) : text;
+            } else if (field === 'tag') {
+                item.tag = el.tagName.toLowerCase();
+            } else if (field === 'attributes') {
+                item.attributes = {};
+                for (const attr of el.attributes) item.attributes[attr.name] = attr.value;
+            } else if (field === 'href') {
+                item.href = el.href || el.getAttribute('href');
+            } else if (field === 'box') {
+                const r = el.getBoundingClientRect();
+                item.box = {x: r.x + window.scrollX, y: r.y + window.scrollY, width: r.width, height: r.height};
+            } else if (field === 'html') {
+                item.html = el.outerHTML;
+            } else if (field === 'value') {
+                item.value = el.value === undefined ? null : el.value;
+            } else if (field === 'visible') {
+                item.visible = !!(el.offsetWidth || el.offsetHeight || el.getClientRects().length);
+            }
+        }
+        return item;
+    });
+    return {count: elements.length, offset: opts.offset, elements: items};
+}
+"""
+
+# Extracción declarativa: una evaluación devuelve todos los registros de la página
+EXTRACT_RECORDS_JS = """
+(rows, fields) => rows.map(row => {
+    const record = {};
+    for (const [name, spec] of Object.entries(fields)) {
+        const targets = !spec.selector ? [row]
+            : spec.all ? Array.from(row.querySelectorAll(spec.selector))
+            : [row.querySelector(spec.selector)];
+        const values = targets.map(el => {
+            if (!el) return null;
+            const attr = spec.attribute || 'text';
+            if (attr === 'text') return (el.innerText || el.textContent || '').trim();
+            if (attr === 'html') return el.innerHTML;
+            if (attr === 'href' || attr === 'src') return el[attr] || el.getAttribute(attr);
+            return el.getAttribute(attr);
+        });
+        record[name] = spec.all ? values : values[0];
+    }
+    return record;
+})
+"""
+
+# Cosecha de feeds infinitos: cada ronda extrae sólo los items con clave no vista (el
+# conjunto de claves vive en la página), hace scroll y espera a que el feed crezca
+HARVEST_JS = """
+async ({selector, fields, key, reset, maxNew, growthMs}) => {
+    const extract = __EXTRACT_RECORDS__;
+    const store = window.__bcHarvest = window.__bcHarvest || {};
+    if (reset) delete store[selector];
+    const seen = store[selector] = store[selector] || new Set();
+    const keyOf = el => {
+        const value = key ? extract([el], {key})[0].key : null;
+        return value == null ? (el.textContent || '').trim().replace(/\\s+/g, ' ').slice(0, 500) : String(value);
+    };
+
+    const elements = Array.from(document.querySelectorAll(selector));
+    const fresh = [];
+    for (const el of elements) {
+        if (maxNew !== null && fresh.length >= maxNew) break;
+        const id = keyOf(el);
+        if (seen.has(id)) continue;
+        seen.add(id);
+        fresh.push(el);
+    }
+    const items = extract(fresh, fields);
+    if ((maxNew !== null && fresh.length >= maxNew) || !growthMs) {
+        return {items, seen: seen.size, grew: null};
+    }
+
+    // Firma del feed: cantidad de items y clave del último (cubre listas virtualizadas)
+    const signature = () => {
+        const all = document.querySelectorAll(selector);
+        return all.length + '|' + (all.length ? keyOf(all[all.length - 1]) : '');
+    };
+    const before = signature();
+    if (elements.length) elements[elements.length - 1].scrollIntoView({block: 'end'});
+    window.scrollTo(0, document.documentElement.scrollHeight);
+    const grew = await new Promise(resolve => {
+        const observer = new MutationObserver(() => { if (signature() !== before) done(true); });
+        const limit = setTimeout(() => done(signature() !== before), growthMs);
+        function done(value) {
+            observer.disconnect();
+            clearTimeout(limit);
+            resolve(value);
+        }
+        observer.observe(document, {childList: true, subtree: true, characterData: true});
+    });
+    return {items, seen: seen.size, grew};
+}
+""".replace("__EXTRACT_RECORDS__", EXTRACT_RECORDS_JS.strip())
+
+# Seguimiento incremental del DOM: un MutationObserver por selector acumula los cambios
+# resumidos en la página y cada llamada devuelve (y vacía) sólo lo ocurrido desde la anterior
+WATCH_DOM_JS = """
+async ({selector, reset, maxText, maxChanges, html, waitMs}) => {
+    const watchers = window.__bcWatchers = window.__bcWatchers || {};
+    const key = selector || ':root';
+    if (reset && watchers[key]) {
+        watchers[key].observer.disconnect();
+        delete watchers[key];
+    }
+    const clip = text => (text || '').trim().replace(/\\s+/g, ' ').slice(0, maxText);
+    const path = node => {
+        const parts = [];
+        for (let el = node; el && el.nodeType === 1 && parts.length < 8; el = el.parentElement) {
+            if (el.id) { parts.unshift('#' + CSS.escape(el.id)); break; }
+            let part = el.tagName.toLowerCase();
+            const parent = el.parentElement;
+            if (parent) {
+                const same = Array.from(parent.children).filter(c => c.tagName === el.tagName);
+                if (same.length > 1) part += ':nth-of-type(' + (same.indexOf(el) + 1) + ')';
+            }
+            parts.unshift(part);
+        }
+        return parts.join(' > ');
+    };
+    const describe = node => {
+        if (node.nodeType === 3) return {node: 'text', text: clip(node.textContent)};
+        if (node.nodeType !== 1) return null;
+        const item = {node: 'element', tag: node.tagName.toLowerCase(), text: clip(node.innerText || node.textContent)};
+        if (html) item.html = node.outerHTML.slice(0, maxText * 10);
+        return item;
+    };
+
+    let watcher = watchers[key];
+    if (!watcher) {
+        const root = selector ? document.querySelector(selector) : document.documentElement;
+        if (!root) throw new Error('No se encontró el elemento: ' + selector);
+        watcher = watchers[key] = {changes: [], dropped: 0, attrs: new Map(), waiters: []};
+        const push = change => {
+            watcher.changes.push(change);
+            if (watcher.changes.length > maxChanges) { watcher.changes.shift(); watcher.dropped++; }
+            watcher.waiters.splice(0).forEach(resolve => resolve());
+        };
+        watcher.observer = new MutationObserver(records => {
+            for (const r of records) {
+                if (r.type === 'childList') {
+                    const parent = path(r.target);
+                    r.addedNodes.forEach(n => { const d = describe(n); if (d && (d.node === 'element' || d.text)) push({type: 'added', parent, path: n.nodeType === 1 ? path(n) : parent, ...d}); });
+                    r.removedNodes.forEach(n => { const d = describe(n); if (d && (d.node === 'element' || d.text)) push({type: 'removed', parent, ...d}); });
+                } else if (r.type === 'attributes') {
+                    // Varios cambios del mismo atributo se funden en uno (old del primero, value actual)
+                    const id = path(r.target) + '@' + r.attributeName;
+                    const pending = watcher.attrs.get(id);
+                    if (pending && watcher.changes.includes(pending)) {
+                        pending.value = r.target.getAttribute(r.attributeName);
+                    } else {
+                        const change = {type: 'attribute', path: path(r.target), name: r.attributeName,
+                                        old: r.oldValue, value: r.target.getAttribute(r.attributeName)};
+                        watcher.attrs.set(id, change);
+                        push(change);
+                    }
+                } else {
+                    push({type: 'text', path: path(r.target.parentElement), old: clip(r.oldValue), value: clip(r.target.textContent)});
+                }
+            }
+        });
+        watcher.observer.observe(root, {childList: true, subtree: true, attributes: true,
+                                        attributeOldValue: true, characterData: true, characterDataOldValue: true});
+        return {installed: true, selector: selector || null, changes: [], count: 0, dropped: 0};
+    }
+
+    if (!watcher.changes.length && waitMs > 0) {
+        await new Promise(resolve => {
+            watcher.waiters.push(resolve);
+            setTimeout(resolve, waitMs);
+        });
+    }
+    const changes = watcher.changes.splice(0);
+    const dropped = watcher.dropped;
+    watcher.dropped = 0;
+    watcher.attrs.clear();
+    return {installed: false, selector: selector || null, changes, count: changes.length, dropped};
+}
+"""
+
+# Métricas de rendimiento de la página actual: Navigation/Resource/Paint Timing y, en
+# Chromium, LCP y layout shifts (los observers con buffered entregan lo ya ocurrido)
+PERFORMANCE_JS = """
+async ({top, entries}) => {
+    const ms = v => v == null ? null : Math.round(v * 10) / 10;
+    const observed = type => new Promise(resolve => {
+        if (!(PerformanceObserver.supportedEntryTypes || []).includes(type)) return resolve(null);
+        const observer = new PerformanceObserver(list => { observer.disconnect(); resolve(list.getEntries()); });
+        observer.observe({type, buffered: true});
+        setTimeout(() => { observer.disconnect(); resolve([]); }, 50);
+    });
+    const [lcp, shifts] = await Promise.all([observed('largest-contentful-paint'), observed('layout-shift')]);
+
+    const nav = performance.getEntriesByType('navigation')[0];
+    const navigation = nav ? {
+        type: nav.type,
+        protocol: nav.nextHopProtocol,
+        dns_ms: ms(nav.domainLookupEnd - nav.domainLookupStart),
+        connect_ms: ms(nav.connectEnd - nav.connectStart),
+        tls_ms: ms(nav.secureConnectionStart > 0 ? nav.connectEnd - nav.secureConnectionStart : 0),
+        ttfb_ms: ms(nav.responseStart),
+        download_ms: ms(nav.responseEnd - nav.responseStart),
+        dom_interactive_ms: ms(nav.domInteractive),
+        dom_content_loaded_ms: ms(nav.domContentLoadedEventEnd),
+        load_ms: nav.loadEventEnd ? ms(nav.loadEventEnd) : null,
+        transfer_bytes: nav.transferSize,
+        encoded_bytes: nav.encodedBodySize,
+        decoded_bytes: nav.decodedBodySize
+    } : null;
+
+    const paints = Object.fromEntries(performance.getEntriesByType('paint').map(e => [e.name, e.startTime]));
+    const paint = {
+        first_paint_ms: ms(paints['first-paint']),
+        first_contentful_paint_ms: ms(paints['first-contentful-paint']),
+        largest_contentful_paint_ms: lcp && lcp.length ? ms(lcp[lcp.length - 1].startTime) : null,
+        cumulative_layout_shift: shifts === null ? null
+            : Math.round(shifts.filter(e => !e.hadRecentInput).reduce((sum, e) => sum + e.value, 0) * 1000) / 1000
+    };
+
+    const list = performance.getEntriesByType('resource');
+    const byType = {};
+    let transfer = 0, encoded = 0, crossOrigin = 0, cached = 0;
+    for (const r of list) {
+        const type = byType[r.initiatorType] = byType[r.initiatorType] || {count: 0, transfer_bytes: 0, encoded_bytes: 0};
+        type.count++;
+        type.transfer_bytes += r.transferSize || 0;
+        type.encoded_bytes += r.encodedBodySize || 0;
+        transfer += r.transferSize || 0;
+        encoded += r.encodedBodySize || 0;
+        if (r.transferSize === 0 && r.encodedBodySize > 0) cached++;
+        if (new URL(r.name, location.href).origin !== location.origin) crossOrigin++;
+    }
+    const slowest = list.slice().sort((a, b) => b.duration - a.duration).slice(0, top).map(r => ({
+        url: r.name.slice(0, 300), type: r.initiatorType, start_ms: ms(r.startTime),
+        duration_ms: ms(r.duration), transfer_bytes: r.transferSize
+    }));
+
+    const result = {
+        navigation,
+        paint,
+        requests: list.length + (nav ? 1 : 0),
+        resources: {count: list.length, transfer_bytes: transfer, encoded_bytes: encoded,
+                    cached, cross_origin: crossOrigin, by_type: byType, slowest},
+        // El buffer de Resource Timing por defecto guarda 250 entradas
+        buffer_full: list.length >= 250
+    };
+    if (entries) {
+        result.entries = {navigation: nav ? nav.toJSON() : null,
+                          paint: performance.getEntriesByType('paint').map(e => e.toJSON()),
+                          resources: list.map(e => e.toJSON())};
+    }
+    return result;
+}
+"""
+
+# Perfiles de bloqueo de red: tipos de recurso a abortar y/o peticiones de terceros
+BLOCK_PROFILES = {
+    "no-media": {"resource_types": ["image", "media", "font"]},
+    "text-only": {"resource_types": ["image", "media", "font", "stylesheet"]},
+    "no-third-party": {"third_party": True},
+}
+
+
+# Sufijos públicos de varias etiquetas más comunes cuando no hay tldextract. Además,
+# bajo un ccTLD de dos letras se tratan como sufijo las segundas etiquetas genéricas
+# (co.uk, com.au, gob.es...). Es una aproximación: otros sufijos de la PSL quedan fuera.
+PUBLIC_SUFFIXES = frozenset({
+    "github.io", "gitlab.io", "blogspot.com", "herokuapp.com", "appspot.com",
+    "cloudfront.net", "azurewebsites.net", "netlify.app", "vercel.app", "pages.dev",
+    "workers.dev", "web.app", "firebaseapp.com", "s3.amazonaws.com", "fly.dev",
+})
+CCTLD_SECOND_LEVELS = frozenset({"co", "com", "net", "org", "gov", "gob", "edu", "ac", "or", "ne", "go", "nom", "ltd", "plc"})
+
+
+@lru_cache(maxsize=1)
+def _tld_extractor():
+    """Extractor de tldextract con la lista de sufijos incluida (sin descargas)."""
+    import tldextract
+    return tldextract.TLDExtract(suffix_list_urls=())
+
+
+@lru_cache(maxsize=4096)
+def _site_of_host(host: str) -> str:
+    """Dominio registrable de un host (sufijo público más una etiqueta)."""
+    if TLDEXTRACT_AVAILABLE:
+        site = _tld_extractor()(host).registered_domain
+        if site:
+            return site
+    labels = host.split(".")
+    size = 2
+    if len(labels) > 2:
+        if ".".join(labels[-2:]) in PUBLIC_SUFFIXES:
+            size = 3
+        elif len(labels[-1]) == 2 and labels[-2] in CCTLD_SECOND_LEVELS:
+            size = 3
+    return ".".join(labels[-size:])
+
+
+def _site(url: str) -> str:
+    """Sitio (dominio registrable) de una URL; las IPs se comparan enteras."""
+    host = (urlsplit(url).hostname or "").lower()
+    if not host or host.replace(".", "").isdigit() or ":" in host:
+        return host
+    return _site_of_host(host)
+
+# Espera adaptativa: resuelve cuando el DOM deja de mutar durante idle ms (o al timeout)
+DOM_IDLE_JS = """
+({idle, timeout}) => new Promise(resolve => {
+    let timer;
+    const observer = new MutationObserver(() => {
+        clearTimeout(timer);
+        timer = setTimeout(() => done(true), idle);
+    });
+    const limit = setTimeout(() => done(false), timeout);
+    function done(quiet) {
+        observer.disconnect();
+        clearTimeout(timer);
+        clearTimeout(limit);
+        resolve(quiet);
+    }
+    observer.observe(document, {subtree: true, childList: true, attributes: true, characterData: true});
+    timer = setTimeout(() => done(true), idle);
+})
+"""
+
+
+# Acciones cuyo tiempo completo cuenta como espera en el desglose de timing
+WAIT_ACTIONS = {"wait_for_selector", "wait_for_load", "sleep"}
+
+# Pasos de control de flujo de los recipes (contienen sub-pasos)
+CONTROL_ACTIONS = {"foreach", "while", "until", "if", "parallel"}
+# Bucles cuya condición se renderiza en cada comprobación (puede usar un save_as del cuerpo)
+LOOP_ACTIONS = {"while", "until"}
+# Tope de iteraciones de un bucle si el paso no declara max_iterations
+MAX_ITERATIONS = 100
+# Campo de data que guarda save_as cuando la acción devuelve varios
+CAPTURE_FIELDS = {"get_elements": "elements", "extract": "records", "harvest": "items", "list_tabs": "tabs"}
+
+
+# Umbral por defecto (bytes) para volcar a archivo los valores grandes con spill_dir
+SPILL_THRESHOLD = 64 * 1024
+
+
+def _compact_payload(value: Any, max_bytes: Optional[int], spill_dir: Optional[str] = None,
+                     label: str = "payload") -> Any:
+    """
+    Reemplaza los strings de más de max_bytes de un resultado.
+    
+    Con spill_dir se escriben a un archivo (los screenshots base64 se decodifican a
+    imagen) y queda {"spilled": ruta, "bytes", "sha256"}; sin él se truncan y queda
+    {"truncated": prefijo, "bytes", "sha256"}.
+    """
+    if isinstance(value, dict):
+        return {key: _compact_payload(item, max_bytes, spill_dir, f"{label}-{key}") for key, item in value.items()}
+    if isinstance(value, list):
+        return [_compact_payload(item, max_bytes, spill_dir, f"{label}-{i}") for i, item in enumerate(value)]
+    if not isinstance(value, str) or not max_bytes or len(value) <= max_bytes // 4:
+        return value
+    raw = value.encode("utf-8")
+    if len(raw) <= max_bytes:
+        return value
+    
+    digest = hashlib.sha256(raw).hexdigest()
+    if not spill_dir:
+        return {"truncated": raw[:max_bytes].decode("utf-8", "ignore"), "bytes": len(raw), "sha256": digest}
+    
+    content, extension = raw, "txt"
+    if label.endswith("-screenshot"):
+        content = base64.b64decode(value)
+        extension = "jpg" if content[:2] == b"\xff\xd8" else "webp" if content[:4] == b"RIFF" else "png"
+    os.makedirs(spill_dir, exist_ok=True)
+    path = os.path.abspath(os.path.join(spill_dir, f"{label}-{digest[:12]}.{extension}"))
+    with open(path, 'wb') as f:
+        f.write(content)
+    return {"spilled": path, "bytes": len(content), "sha256": digest}
+
+
+def _write_trace_events(path: str, name: str, started: float, results: List[Dict[str, Any]],
+                        starts: List[float]) -> str:
+    """
+    Escribe la ejecución de un recipe como JSON de trace events de Chrome.
+    
+    Cada paso es un evento completo ("X") con sus fases render/wait/action/serialize
+    anidadas; se abre en chrome://tracing o ui.perfetto.dev.
+    """
+    pid = os.getpid()
+    events = [{"name": "process_name", "ph": "M", "pid": pid, "tid": 0, "args": {"name": f"recipe {name}"}}]
+    for entry, step_started in zip(results, starts):
+        timing = entry["timing"]
+        ts = (step_started - started) * 1e6
+        events.append({
+            "name": f'{entry["step"]}. {entry["action"]}', "cat": "step", "ph": "X", "pid": pid, "tid": 0,
+            "ts": round(ts, 1), "dur": round(timing["total_ms"] * 1000, 1),
+            "args": {"description": entry["description"], "success": entry["result"]["success"]}
+        })
+        for phase in ("render", "wait", "action", "serialize"):
+            duration = timing[f"{phase}_ms"]
+            if duration:
+                events.append({"name": phase, "cat": "phase", "ph": "X", "pid": pid, "tid": 0,
+                               "ts": round(ts, 1), "dur": round(duration * 1000, 1)})
+            ts += duration * 1000
+    
+    path = os.path.abspath(path)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return path
+
+
+# Cada cuánto (segundos) se mide el RSS del navegador para el reciclado por memoria
+RSS_CHECK_INTERVAL = 2.0
+# Separación mínima (segundos) entre dos reciclados automáticos de un motor
+RECYCLE_MIN_INTERVAL = 60.0
+
+
+def _process_tree_rss_kb(root_pid: int, include_root: bool = True) -> Optional[int]:
+    """
+    RSS (KB) de un proceso y todos sus descendientes, leyendo /proc.
+    
+    Devuelve None en plataformas sin /proc.
+    """
+    if not os.path.isdir("/proc/self"):
+        return None
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                # El nombre del proceso va entre paréntesis y puede contener espacios
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    
+    total = 0
+    pending = [root_pid] if include_root else list(children.get(root_pid, []))
+    while pending:
+        pid = pending.pop()
+        try:
+            with open(f"/proc/{pid}/status", 'r') as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1])
+                        break
+        except OSError:
+            pass
+        pending.extend(children.get(pid, []))
+    return total
+
+
+def _screenshot_dir(directory: str) -> str:
+    """Resuelve el directorio de screenshots; "shm" usa memoria compartida si existe."""
+    if directory == "shm":
+        return "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+    return directory
 
 
 @dataclass
@@ -39,12 +568,284 @@ class ActionResult:
     title: Optional[str] = None
     
     def to_dict(self) -> Dict[str, Any]:
-        return asdict(self)
+        # Copia superficial: asdict copiaría en profundidad data (HTML, listas de elementos...)
+        return {
+            "success": self.success,
+            "action": self.action,
+            "data": self.data,
+            "error": self.error,
+            "screenshot": self.screenshot,
+            "url": self.url,
+            "title": self.title
+        }
+
+
+class RecipeIndex:
+    """
+    Índice en disco con los metadatos de los recipes.
+    
+    Cada entrada se invalida por mtime y tamaño del archivo, así que sólo se vuelven
+    a parsear los recipes que cambiaron. Permite búsqueda exacta y por prefijo sin
+    abrir los archivos.
+    """
+    
+    FILENAME = ".index.json"
+    VERSION = 1
+    
+    def __init__(self, recipes_dir: str):
+        self.recipes_dir = recipes_dir
+        self.path = os.path.join(recipes_dir, self.FILENAME)
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        self._loaded = False
+        self._names: Dict[str, str] = {}
+        self._keys: List[str] = []
+    
+    @staticmethod
+    def _read_entry(recipe_path: str, filename: str, stat: os.stat_result) -> Dict[str, Any]:
+        """Parsea un recipe y extrae sus metadatos."""
+        entry = {"filename": filename, "mtime": stat.st_mtime_ns, "size": stat.st_size}
+        try:
+            with open(recipe_path, 'r', encoding='utf-8') as f:
+                recipe = json.load(f)
+            entry.update({
+                "name": recipe.get("name", filename[:-5]),
+                "description": recipe.get("description", ""),
+                "steps_count": len(recipe.get("steps", [])),
+                "variables": list(recipe.get("variables", {}).keys()),
+                "created_at": recipe.get("created_at", "")
+            })
+        except Exception:
+            entry.update({
+                "name": filename[:-5],
+                "description": "Error al leer recipe",
+                "steps_count": 0,
+                "variables": [],
+                "created_at": ""
+            })
+        return entry
+    
+    def refresh(self) -> 'RecipeIndex':
+        """Sincroniza el índice con el directorio, reparseando sólo lo modificado."""
+        if not self._loaded:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    stored = json.load(f)
+                if stored.get("version") == self.VERSION:
+                    self.entries = stored.get("entries", {})
+            except (OSError, ValueError):
+                self.entries = {}
+            self._loaded = True
+        
+        entries = {}
+        changed = False
+        if os.path.isdir(self.recipes_dir):
+            with os.scandir(self.recipes_dir) as it:
+                for dir_entry in it:
+                    filename = dir_entry.name
+                    if not filename.endswith('.json') or filename.startswith('.'):
+                        continue
+                    stat = dir_entry.stat()
+                    cached = self.entries.get(filename)
+                    if cached and cached["mtime"] == stat.st_mtime_ns and cached["size"] == stat.st_size:
+                        entries[filename] = cached
+                    else:
+                        entries[filename] = self._read_entry(dir_entry.path, filename, stat)
+                        changed = True
+        
+        changed = changed or entries.keys() != self.entries.keys()
+        self.entries = entries
+        self._rebuild_lookup()
+        if changed:
+            self.save()
+        return self
+    
+    def _rebuild_lookup(self):
+        """Reconstruye las tablas de búsqueda exacta y por prefijo."""
+        self._keys = sorted(filename[:-5] for filename in self.entries)
+        self._names = {entry["name"].lower(): filename for filename, entry in self.entries.items()}
+    
+    def save(self):
+        """Escribe el índice de forma atómica (se ignora si el directorio no es escribible)."""
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.recipes_dir, prefix=".index-", suffix=".tmp")
+        except OSError:
+            return
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({"version": self.VERSION, "entries": self.entries}, f, ensure_ascii=False)
+            # mkstemp crea el archivo 0600: el índice de un directorio compartido debe
+            # poder leerlo cualquiera que pueda leer los recipes
+            umask = os.umask(0)
+            os.umask(umask)
+            os.chmod(tmp_path, 0o644 & ~umask)
+            os.replace(tmp_path, self.path)
+        except OSError:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+    
+    def with_prefix(self, prefix: str) -> List[Dict[str, Any]]:
+        """Entradas cuyo nombre de archivo empieza por el prefijo, en orden."""
+        start = bisect.bisect_left(self._keys, prefix)
+        matches = []
+        for key in self._keys[start:]:
+            if not key.startswith(prefix):
+                break
+            matches.append(self.entries[f"{key}.json"])
+        return matches
+    
+    def find(self, name: str) -> Optional[str]:
+        """
+        Busca el archivo de un recipe: nombre de archivo exacto, nombre declarado,
+        prefijo y, por compatibilidad, coincidencia parcial.
+        """
+        key = os.path.basename(RecipeManager.get_recipe_path(name))[:-5]
+        if f"{key}.json" in self.entries:
+            return f"{key}.json"
+        if name.lower() in self._names:
+            return self._names[name.lower()]
+        prefixed = self.with_prefix(key)
+        if prefixed:
+            return prefixed[0]["filename"]
+        for filename in sorted(self.entries):
+            if name.lower() in filename.lower():
+                return filename
+        return None
+
+
+class RecipeTemplate:
+    """
+    Recipe compilado: los placeholders {{variable}} se localizan una sola vez.
+    
+    Los params de cada paso (incluidos dicts y listas anidados) se convierten en un
+    árbol donde las partes sin variables quedan como literales; ejecutar el recipe
+    sólo sustituye las posiciones que tienen placeholders.
+    """
+    
+    # Como el str.replace original, el nombre admite guiones, puntos, etc. (no espacios)
+    PLACEHOLDER = re.compile(r"\{\{([^{}\s]+)\}\}")
+    LITERAL, VARIABLE, FORMAT, DICT, LIST = range(5)
+    
+    def __init__(self, recipe: Dict[str, Any]):
+        self.recipe = recipe
+        self.placeholders: set = set()
+        # Variables que el propio recipe define al ejecutarse (save_as, variables de bucle)
+        self.provided: set = set()
+        self.steps = self.compile_steps(recipe.get("steps", []))
+        # El nombre de la sesión puede depender de variables ("proton-{{usuario}}")
+        session = recipe.get("session")
+        self.session = self.compile(session if isinstance(session, dict) else {"name": session}) if session else None
+    
+    def compile_steps(self, steps: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Compila los params de cada paso, incluidos los sub-pasos de los pasos de control."""
+        compiled = []
+        for step in steps:
+            step = dict(step, params=self.compile(step.get("params", {})))
+            for key in ("steps", "then", "else"):
+                if key in step:
+                    step[key] = self.compile_steps(step[key])
+            if "branches" in step:
+                step["branches"] = [self.compile_steps(branch) for branch in step["branches"]]
+            for key in ("save_as", "append_to"):
+                if step.get(key):
+                    self.provided.add(step[key])
+            if step.get("action") in ("foreach", "parallel"):
+                name = step.get("as", "item")
+                self.provided.update((name, f"{name}_index", f"{name}_selector"))
+            compiled.append(step)
+        return compiled
+    
+    def compile(self, value: Any) -> tuple:
+        """Compila un valor a un nodo (tipo, contenido)."""
+        if isinstance(value, str):
+            parts = self.PLACEHOLDER.split(value)
+            if len(parts) == 1:
+                return (self.LITERAL, value)
+            self.placeholders.update(parts[1::2])
+            # Un placeholder solo conserva el tipo del valor (número, lista...)
+            if len(parts) == 3 and not parts[0] and not parts[2]:
+                return (self.VARIABLE, parts[1])
+            return (self.FORMAT, parts)
+        if isinstance(value, dict):
+            items = [(key, self.compile(item)) for key, item in value.items()]
+            if all(node[0] == self.LITERAL for _, node in items):
+                return (self.LITERAL, value)
+            return (self.DICT, items)
+        if isinstance(value, list):
+            nodes = [self.compile(item) for item in value]
+            if all(node[0] == self.LITERAL for node in nodes):
+                return (self.LITERAL, value)
+            return (self.LIST, nodes)
+        return (self.LITERAL, value)
+    
+    def render(self, node: tuple, values: Dict[str, Any]) -> Any:
+        """Sustituye las variables de un nodo compilado (ValueError si alguna no tiene valor)."""
+        kind, payload = node
+        if kind == self.LITERAL:
+            return payload
+        try:
+            if kind == self.VARIABLE:
+                return self.lookup(values, payload)
+            if kind == self.FORMAT:
+                return "".join(part if i % 2 == 0 else str(self.lookup(values, part))
+                               for i, part in enumerate(payload))
+        except KeyError as e:
+            # Variables de save_as/append_to usadas antes del paso que las define
+            raise ValueError(f"variable '{e.args[0]}' no definida") from None
+        if kind == self.DICT:
+            return {key: self.render(item, values) for key, item in payload}
+        return [self.render(item, values) for item in payload]
+    
+    @staticmethod
+    def lookup(values: Dict[str, Any], name: str) -> Any:
+        """
+        Valor de un placeholder. Si no hay una variable con ese nombre exacto,
+        "link.href" accede al campo href de {{link}} (y "filas.0" a un índice).
+        """
+        try:
+            return values[name]
+        except KeyError:
+            root, dot, path = name.partition(".")
+            if not dot or root not in values:
+                raise
+        value = values[root]
+        try:
+            for key in path.split("."):
+                value = value[int(key)] if isinstance(value, list) else value[key]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise KeyError(name) from None
+        return value
+    
+    def missing(self, values: Dict[str, Any]) -> List[str]:
+        """Placeholders sin valor ni default declarado (para "a.b" basta con "a")."""
+        known = self.provided | set(self.recipe.get("variables", {})) | set(values)
+        return sorted(name for name in self.placeholders
+                      if name not in known and name.partition(".")[0] not in known)
 
 
 class RecipeManager:
     """Gestiona recipes (recetas) de automatización."""
     
+    _index: Optional[RecipeIndex] = None
+    _compiled: Dict[str, tuple] = {}
+    
+    @staticmethod
+    def get_index() -> RecipeIndex:
+        """Devuelve el índice de recipes sincronizado con el directorio."""
+        if RecipeManager._index is None or RecipeManager._index.recipes_dir != RECIPES_DIR:
+            RecipeManager._index = RecipeIndex(RECIPES_DIR)
+        return RecipeManager._index.refresh()
+    
+    @staticmethod
+    def find_recipe_path(name: str) -> Optional[str]:
+        """Resuelve el archivo de un recipe por nombre exacto o parcial."""
+        recipe_path = RecipeManager.get_recipe_path(name)
+        if os.path.exists(recipe_path):
+            return recipe_path
+        filename = RecipeManager.get_index().find(name)
+        return os.path.join(RECIPES_DIR, filename) if filename else None
+    
     @staticmethod
     def get_recipe_path(name: str) -> str:
         """Obtiene la ruta del archivo de un recipe."""
@@ -66,8 +867,10 @@ class RecipeManager:
             }
             
             recipe_path = RecipeManager.get_recipe_path(name)
+            os.makedirs(RECIPES_DIR, exist_ok=True)
             with open(recipe_path, 'w', encoding='utf-8') as f:
                 json.dump(recipe, f, indent=2, ensure_ascii=False)
+            RecipeManager.get_index()
             
             return ActionResult(
                 success=True,
@@ -83,34 +886,50 @@ class RecipeManager:
             return ActionResult(success=False, action="create_recipe", error=str(e))
     
     @staticmethod
-    def list_recipes() -> ActionResult:
-        """Lista todos los recipes disponibles."""
-        try:
-            recipes = []
-            if os.path.exists(RECIPES_DIR):
-                for filename in sorted(os.listdir(RECIPES_DIR)):
-                    if filename.endswith('.json'):
-                        recipe_path = os.path.join(RECIPES_DIR, filename)
-                        try:
-                            with open(recipe_path, 'r', encoding='utf-8') as f:
-                                recipe = json.load(f)
-                                recipes.append({
-                                    "name": recipe.get("name", filename[:-5]),
-                                    "description": recipe.get("description", ""),
-                                    "filename": filename,
-                                    "steps_count": len(recipe.get("steps", [])),
-                                    "variables": list(recipe.get("variables", {}).keys()),
-                                    "created_at": recipe.get("created_at", "")
-                                })
-                        except Exception:
-                            recipes.append({
-                                "name": filename[:-5],
-                                "description": "Error al leer recipe",
-                                "filename": filename,
-                                "steps_count": 0,
-                                "variables": [],
-                                "created_at": ""
-                            })
+    def compile_recipe(name: str) -> ActionResult:
+        """
+        Carga un recipe compilado, reutilizando la compilación mientras el archivo
+        no cambie (mtime y tamaño).
+        """
+        try:
+            recipe_path = RecipeManager.find_recipe_path(name)
+            if not recipe_path:
+                return ActionResult(
+                    success=False,
+                    action="compile_recipe",
+                    error=f"Recipe no encontrado: {name}"
+                )
+            
+            stat = os.stat(recipe_path)
+            cached = RecipeManager._compiled.get(recipe_path)
+            if cached and cached[0] == (stat.st_mtime_ns, stat.st_size):
+                template = cached[1]
+            else:
+                with open(recipe_path, 'r', encoding='utf-8') as f:
+                    template = RecipeTemplate(json.load(f))
+                RecipeManager._compiled[recipe_path] = ((stat.st_mtime_ns, stat.st_size), template)
+            
+            return ActionResult(success=True, action="compile_recipe", data={"template": template})
+        except Exception as e:
+            return ActionResult(success=False, action="compile_recipe", error=str(e))
+    
+    @staticmethod
+    def list_recipes(prefix: Optional[str] = None) -> ActionResult:
+        """Lista todos los recipes disponibles (opcionalmente sólo los de un prefijo)."""
+        try:
+            index = RecipeManager.get_index()
+            if prefix:
+                entries = index.with_prefix(os.path.basename(RecipeManager.get_recipe_path(prefix))[:-5])
+            else:
+                entries = [index.entries[filename] for filename in sorted(index.entries)]
+            recipes = [{
+                "name": entry["name"],
+                "description": entry["description"],
+                "filename": entry["filename"],
+                "steps_count": entry["steps_count"],
+                "variables": entry["variables"],
+                "created_at": entry["created_at"]
+            } for entry in entries]
             
             return ActionResult(
                 success=True,
@@ -127,18 +946,9 @@ class RecipeManager:
     def show_recipe(name: str) -> ActionResult:
         """Muestra el contenido de un recipe."""
         try:
-            recipe_path = RecipeManager.get_recipe_path(name)
-            
-            # Intentar encontrar por nombre exacto o parcial
-            if not os.path.exists(recipe_path):
-                # Buscar coincidencia parcial
-                for filename in os.listdir(RECIPES_DIR):
-                    if filename.endswith('.json'):
-                        if name.lower() in filename.lower():
-                            recipe_path = os.path.join(RECIPES_DIR, filename)
-                            break
-            
-            if not os.path.exists(recipe_path):
+            # Encontrar por nombre exacto o parcial
+            recipe_path = RecipeManager.find_recipe_path(name)
+            if not recipe_path:
                 return ActionResult(
                     success=False,
                     action="show_recipe",
@@ -160,17 +970,9 @@ class RecipeManager:
     def delete_recipe(name: str) -> ActionResult:
         """Elimina un recipe."""
         try:
-            recipe_path = RecipeManager.get_recipe_path(name)
-            
-            # Intentar encontrar por nombre exacto o parcial
-            if not os.path.exists(recipe_path):
-                for filename in os.listdir(RECIPES_DIR):
-                    if filename.endswith('.json'):
-                        if name.lower() in filename.lower():
-                            recipe_path = os.path.join(RECIPES_DIR, filename)
-                            break
-            
-            if not os.path.exists(recipe_path):
+            # Encontrar por nombre exacto o parcial
+            recipe_path = RecipeManager.find_recipe_path(name)
+            if not recipe_path:
                 return ActionResult(
                     success=False,
                     action="delete_recipe",
@@ -178,6 +980,7 @@ class RecipeManager:
                 )
             
             os.remove(recipe_path)
+            RecipeManager.get_index()
             return ActionResult(
                 success=True,
                 action="delete_recipe",
@@ -189,74 +992,298 @@ class RecipeManager:
     @staticmethod
     def run_recipe(name: str, variable_values: Optional[Dict[str, str]] = None,
                    controller: Optional['BrowserController'] = None,
-                   headless: bool = True, browser_type: str = "chromium") -> ActionResult:
-        """Ejecuta un recipe."""
+                   headless: bool = True, browser_type: str = "chromium",
+                   trace: Optional[str] = None, session: Optional[str] = None,
+                   checkpoint: bool = False, resume: bool = False,
+                   on_step: Optional[Callable[[Dict[str, Any]], None]] = None,
+                   max_payload: Optional[int] = None, spill_dir: Optional[str] = None,
+                   **engine_options) -> ActionResult:
+        """Ejecuta un recipe (envoltorio síncrono de run_recipe_async)."""
+        options = {"trace": trace, "session": session, "checkpoint": checkpoint, "resume": resume,
+                   "on_step": on_step, "max_payload": max_payload, "spill_dir": spill_dir}
+        if controller is not None:
+            return controller.run(RecipeManager.run_recipe_async(
+                name, variable_values, engine=controller.engine, **options
+            ))
+        return asyncio.run(RecipeManager.run_recipe_async(
+            name, variable_values, headless=headless, browser_type=browser_type, **options, **engine_options
+        ))
+    
+    @staticmethod
+    def get_checkpoint_path(name: str, variables: Dict[str, Any]) -> str:
+        """Checkpoint de un recipe para un conjunto concreto de variables."""
+        safe_name = os.path.basename(RecipeManager.get_recipe_path(name))[:-5]
+        digest = hashlib.sha1(json.dumps(variables, sort_keys=True, default=str).encode()).hexdigest()[:12]
+        return os.path.join(CHECKPOINTS_DIR, f"{safe_name}-{digest}.json")
+    
+    @staticmethod
+    def _steps_digest(recipe: Dict[str, Any], upto: int) -> str:
+        """Huella de los pasos ya ejecutados: corregir los siguientes no invalida el checkpoint."""
+        return hashlib.sha1(json.dumps(recipe.get("steps", [])[:upto], sort_keys=True).encode()).hexdigest()
+    
+    @staticmethod
+    def _checkpoint_steps_path(path: str) -> str:
+        """Resúmenes de los pasos de un checkpoint (JSONL, uno por paso)."""
+        return path[:-len(".json")] + ".steps.jsonl"
+    
+    @staticmethod
+    def _append_checkpoint_step(path: str, entry: Dict[str, Any]):
+        """Añade el resumen de un paso sin reescribir los anteriores."""
+        os.makedirs(CHECKPOINTS_DIR, exist_ok=True)
+        fd = os.open(RecipeManager._checkpoint_steps_path(path), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        with os.fdopen(fd, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+    
+    @staticmethod
+    def _read_checkpoint_steps(path: str, next_step: int) -> List[Dict[str, Any]]:
+        """Resúmenes de los pasos anteriores a next_step; descarta los de intentos sin checkpoint."""
+        steps_path = RecipeManager._checkpoint_steps_path(path)
+        if not os.path.exists(steps_path):
+            return []
+        with open(steps_path, 'r', encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        entries = [entry for entry in entries if entry["step"] <= next_step]
+        fd = os.open(steps_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.writelines(json.dumps(entry, ensure_ascii=False, default=str) + "\n" for entry in entries)
+        return entries
+    
+    @staticmethod
+    def _write_checkpoint(path: str, checkpoint: Dict[str, Any]):
+        """Escribe un checkpoint de forma atómica (contiene cookies: sólo legible por el usuario)."""
+        os.makedirs(CHECKPOINTS_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=CHECKPOINTS_DIR, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(checkpoint, f, ensure_ascii=False, default=str)
+            os.chmod(tmp_path, 0o600)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+    
+    @staticmethod
+    async def run_recipe_async(name: str, variable_values: Optional[Dict[str, str]] = None,
+                               engine: Optional['AsyncBrowserController'] = None,
+                               headless: bool = True, browser_type: str = "chromium",
+                               trace: Optional[str] = None, session: Optional[str] = None,
+                               checkpoint: bool = False, resume: bool = False,
+                               on_step: Optional[Callable[[Dict[str, Any]], None]] = None,
+                               max_payload: Optional[int] = None, spill_dir: Optional[str] = None,
+                               **engine_options) -> ActionResult:
+        """
+        Ejecuta un recipe sobre el motor asíncrono.
+        
+        on_step recibe el resultado de cada paso en cuanto termina; en ese caso el
+        resultado final sólo conserva un resumen por paso (sin data), de modo que la
+        memoria no crece con el tamaño de las salidas. max_payload y spill_dir
+        truncan o vuelcan a archivo los valores grandes (HTML, texto, screenshots).
+        
+        Con checkpoint, tras cada paso correcto se guarda URL, storage_state, índice
+        del paso y variables resueltas; resume continúa desde el último checkpoint
+        del mismo recipe y variables (si los pasos no cambiaron desde entonces). Al
+        terminar bien el checkpoint se borra.
+        
+        Si el recipe declara "session" (o se pasa session) se restaura ese perfil antes
+        del primer paso y se omiten los pasos marcados con "login": true; si no hay
+        perfil vigente se ejecutan todos y al terminar bien se guarda la sesión.
+        
+        Cada paso registra su timing (render, wait, action y serialize en ms) y el
+        resultado incluye los pasos más lentos. Con trace se exporta la ejecución:
+        un .zip es un trace de Playwright y cualquier otra ruta un JSON de trace
+        events de Chrome.
+        
+        engine_options se pasan a AsyncBrowserController cuando el recipe crea su
+        propio motor (por ejemplo block y block_urls).
+        """
+        own_engine = False
+        previous_blocking = None
+        tracing = False
         try:
-            # Cargar recipe
-            show_result = RecipeManager.show_recipe(name)
-            if not show_result.success:
-                return show_result
+            # Cargar recipe compilado
+            compile_result = RecipeManager.compile_recipe(name)
+            if not compile_result.success:
+                return compile_result
             
-            recipe = show_result.data
-            steps = recipe.get("steps", [])
-            variables = recipe.get("variables", {})
+            template: RecipeTemplate = compile_result.data["template"]
+            recipe = template.recipe
             
             # Mezclar variables con valores proporcionados
-            exec_variables = variables.copy()
+            exec_variables = dict(recipe.get("variables", {}))
             if variable_values:
                 exec_variables.update(variable_values)
             
-            # Inicializar controlador si no se proporcionó
-            own_controller = controller is None
-            if own_controller:
+            missing = template.missing(exec_variables)
+            if missing:
+                return ActionResult(
+                    success=False,
+                    action="run_recipe",
+                    error=f"Variables sin valor: {', '.join(missing)}"
+                )
+            
+            # Inicializar motor si no se proporcionó
+            if engine is None:
                 if not PLAYWRIGHT_AVAILABLE:
                     return ActionResult(
                         success=False,
                         action="run_recipe",
                         error="Playwright no está instalado. Ejecuta: pip install playwright && playwright install"
                     )
-                controller = BrowserController(headless=headless, browser_type=browser_type)
-                start_result = controller.start()
+                engine = AsyncBrowserController(headless=headless, browser_type=browser_type, **engine_options)
+                start_result = await engine.start()
                 if not start_result.success:
                     return start_result
+                own_engine = True
+            
+            # Bloqueo de red declarado en el recipe (se restaura al terminar)
+            if recipe.get("block") or recipe.get("block_urls"):
+                previous_blocking = (engine.block, engine.block_urls)
+                block_result = await engine.set_blocking(
+                    engine.block + list(recipe.get("block", [])),
+                    engine.block_urls + list(recipe.get("block_urls", []))
+                )
+                if not block_result.success:
+                    return block_result
+            
+            # Retomar desde el último checkpoint válido
+            checkpoint = checkpoint or resume
+            checkpoint_path = RecipeManager.get_checkpoint_path(recipe.get("name", name), exec_variables)
+            previous_results = []
+            start_index = 0
+            resumed_from = None
+            if resume and os.path.exists(checkpoint_path):
+                with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+                if saved.get("steps_digest") == RecipeManager._steps_digest(recipe, saved["next_step"]):
+                    restore_result = await engine.restore_state(saved["storage_state"], saved.get("url"))
+                    if not restore_result.success:
+                        return restore_result
+                    exec_variables = saved["variables"]
+                    start_index = saved["next_step"]
+                    previous_results = RecipeManager._read_checkpoint_steps(checkpoint_path, start_index)
+                    resumed_from = start_index + 1
+            if checkpoint and resumed_from is None and os.path.exists(
+                    RecipeManager._checkpoint_steps_path(checkpoint_path)):
+                os.remove(RecipeManager._checkpoint_steps_path(checkpoint_path))
+            
+            # Sesión guardada: restaurarla para saltar el login
+            session_spec = template.render(template.session, exec_variables) if template.session else {}
+            if session:
+                session_spec = dict(session_spec, name=session)
+            session_info = None
+            if session_spec.get("name") and resumed_from is None:
+                load_result = await engine.load_session(session_spec["name"], session_spec.get("check"))
+                session_info = {"name": session_spec["name"], "restored": load_result.success,
+                                "reason": load_result.error, "saved": False}
+            skip_login = bool(session_info and session_info["restored"])
+            
+            if trace and trace.endswith(".zip"):
+                await engine.context.tracing.start(screenshots=True, snapshots=True, sources=False)
+                tracing = True
+            
+            if spill_dir and not max_payload:
+                max_payload = SPILL_THRESHOLD
             
             results = []
+            starts = []
             final_result = None
+            run_started = time.perf_counter()
             
             # Ejecutar cada paso
-            for i, step in enumerate(steps):
+            for i, step in enumerate(template.steps):
                 step_action = step.get("action")
-                step_params = step.get("params", {})
                 step_description = step.get("description", f"Paso {i+1}")
+                if i < start_index or (skip_login and step.get("login")):
+                    continue
+                step_started = time.perf_counter()
                 
-                # Reemplazar variables en parámetros
-                processed_params = {}
-                for key, value in step_params.items():
-                    if isinstance(value, str):
-                        # Reemplazar {{variable}} con su valor
-                        for var_name, var_value in exec_variables.items():
-                            value = value.replace(f"{{{{{var_name}}}}}", var_value)
-                    processed_params[key] = value
+                try:
+                    # Reemplazar variables en parámetros
+                    processed_params = {} if step_action in LOOP_ACTIONS else \
+                        template.render(step["params"], exec_variables)
+                    rendered = time.perf_counter()
+                    
+                    # Ejecutar acción (o bloque de control de flujo)
+                    result = await RecipeManager._execute_step(engine, template, step, processed_params,
+                                                               exec_variables)
+                except ValueError as e:
+                    raise ValueError(f"{e} en el paso {i+1}") from None
+                executed = time.perf_counter()
+                result_dict = result.to_dict()
+                if max_payload:
+                    result_dict = _compact_payload(result_dict, max_payload, spill_dir, f"step-{i+1}")
+                serialized = time.perf_counter()
                 
-                # Ejecutar acción
-                result = controller.execute_action(step_action, processed_params)
-                results.append({
+                executed_ms = (executed - rendered) * 1000
+                if step_action in WAIT_ACTIONS:
+                    wait_ms = executed_ms
+                else:
+                    wait_ms = min((result.data or {}).get("waited_ms") or 0, executed_ms)
+                entry = {
                     "step": i + 1,
                     "description": step_description,
                     "action": step_action,
-                    "result": result.to_dict()
-                })
+                    "result": result_dict,
+                    "timing": {
+                        "total_ms": round((serialized - step_started) * 1000, 2),
+                        "render_ms": round((rendered - step_started) * 1000, 2),
+                        "wait_ms": round(wait_ms, 2),
+                        "action_ms": round(executed_ms - wait_ms, 2),
+                        "serialize_ms": round((serialized - executed) * 1000, 2)
+                    }
+                }
+                if on_step:
+                    on_step(entry)
+                    # Ya entregado: sólo se retiene el resumen del paso
+                    entry = dict(entry, result={key: result_dict[key]
+                                                for key in ("success", "action", "error", "url", "title")})
+                results.append(entry)
+                starts.append(step_started)
                 
                 final_result = result
                 
                 # Si un paso falla, detener ejecución
                 if not result.success:
                     break
+                
+                if checkpoint:
+                    # Sólo el resumen del paso, añadido al JSONL: sin HTML ni capturas y sin
+                    # reescribir los pasos anteriores
+                    RecipeManager._append_checkpoint_step(checkpoint_path, dict(entry, result={
+                        key: result_dict.get(key) for key in ("success", "action", "error", "url", "title")
+                    }))
+                    RecipeManager._write_checkpoint(checkpoint_path, {
+                        "recipe": recipe.get("name", name),
+                        "steps_digest": RecipeManager._steps_digest(recipe, i + 1),
+                        "updated_at": datetime.now().isoformat(),
+                        "next_step": i + 1,
+                        "url": engine.page.url,
+                        "variables": exec_variables,
+                        "storage_state": await engine.context.storage_state()
+                    })
+            
+            total_ms = (time.perf_counter() - run_started) * 1000
+            if checkpoint and (final_result is None or final_result.success):
+                for path in (checkpoint_path, RecipeManager._checkpoint_steps_path(checkpoint_path)):
+                    if os.path.exists(path):
+                        os.remove(path)
             
-            # Cerrar controlador si lo creamos nosotros
-            if own_controller:
-                controller.stop()
+            if session_info and not skip_login and (final_result is None or final_result.success):
+                save_result = await engine.save_session(session_spec["name"], session_spec.get("ttl", SESSION_TTL),
+                                                        session_spec.get("check"))
+                session_info["saved"] = save_result.success
+                if not save_result.success:
+                    session_info["reason"] = save_result.error
+            trace_path = None
+            if tracing:
+                trace_path = os.path.abspath(trace)
+                await engine.context.tracing.stop(path=trace_path)
+                tracing = False
+            elif trace:
+                trace_path = _write_trace_events(trace, recipe.get("name"), run_started, results, starts)
             
+            results = previous_results + results
+            slowest = sorted(results, key=lambda r: r["timing"]["total_ms"], reverse=True)[:5]
             return ActionResult(
                 success=final_result.success if final_result else True,
                 action="run_recipe",
@@ -266,26 +1293,804 @@ class RecipeManager:
                     "all_success": all(r["result"]["success"] for r in results),
                     "results": results,
                     "final_url": final_result.url if final_result else None,
-                    "final_title": final_result.title if final_result else None
+                    "final_title": final_result.title if final_result else None,
+                    "timing": {
+                        "total_ms": round(total_ms, 2),
+                        "wait_ms": round(sum(r["timing"]["wait_ms"] for r in results), 2),
+                        "action_ms": round(sum(r["timing"]["action_ms"] for r in results), 2),
+                        "slowest": [{"step": r["step"], "action": r["action"],
+                                     "description": r["description"], **r["timing"]} for r in slowest]
+                    },
+                    "trace": trace_path,
+                    "session": session_info,
+                    "resumed_from": resumed_from,
+                    "checkpoint": checkpoint_path if checkpoint and os.path.exists(checkpoint_path) else None
                 }
             )
             
         except Exception as e:
             return ActionResult(success=False, action="run_recipe", error=str(e))
+        finally:
+            if tracing:
+                try:
+                    await engine.context.tracing.stop()
+                except Exception:
+                    pass
+            # Cerrar motor si lo creamos nosotros
+            if own_engine:
+                await engine.stop()
+            elif previous_blocking is not None:
+                await engine.set_blocking(*previous_blocking)
+    
+    @staticmethod
+    async def _execute_step(engine: 'AsyncBrowserController', template: RecipeTemplate, step: Dict[str, Any],
+                            params: Dict[str, Any], variables: Dict[str, Any]) -> ActionResult:
+        """
+        Ejecuta un paso ya renderizado: una acción del motor o un bloque de control.
+        
+        save_as guarda el resultado como variable para los pasos siguientes y
+        append_to lo acumula en una lista (útil dentro de foreach).
+        """
+        action = step.get("action")
+        if action in CONTROL_ACTIONS:
+            result = await RecipeManager._run_control(engine, template, step, params, variables)
+        else:
+            result = await engine.execute_action(action, params)
+        
+        if result.success and (step.get("save_as") or step.get("append_to")):
+            data = result.data or {}
+            if action in CAPTURE_FIELDS:
+                value = data.get(CAPTURE_FIELDS[action])
+            elif len(data) == 1:
+                value = next(iter(data.values()))
+            else:
+                value = data
+            if step.get("save_as"):
+                variables[step["save_as"]] = value
+            if step.get("append_to"):
+                variables[step["append_to"]] = list(variables.get(step["append_to"]) or []) + [value]
+        return result
+    
+    @staticmethod
+    async def _run_block(engine: 'AsyncBrowserController', template: RecipeTemplate,
+                         steps: List[Dict[str, Any]], variables: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Ejecuta una lista de sub-pasos hasta el primer fallo."""
+        results = []
+        for i, step in enumerate(steps):
+            started = time.perf_counter()
+            params = {} if step.get("action") in LOOP_ACTIONS else template.render(step["params"], variables)
+            result = await RecipeManager._execute_step(engine, template, step, params, variables)
+            results.append({
+                "step": i + 1,
+                "description": step.get("description", f"Paso {i+1}"),
+                "action": step.get("action"),
+                "result": result.to_dict(),
+                "elapsed_ms": round((time.perf_counter() - started) * 1000, 2)
+            })
+            if not result.success:
+                break
+        return results
+    
+    @staticmethod
+    async def _run_control(engine: 'AsyncBrowserController', template: RecipeTemplate, step: Dict[str, Any],
+                           params: Dict[str, Any], variables: Dict[str, Any]) -> ActionResult:
+        """
+        Ejecuta foreach, while, until, if o parallel dentro de la misma sesión del navegador.
+        
+        foreach recorre params.items (lista) o los matches de params.selector; en cada
+        vuelta define {{as}}, {{as_index}} y, para elementos, {{as_selector}} (el
+        selector del match concreto). if evalúa la condición de params; while/until
+        renderizan la suya antes de cada comprobación (params llega vacío).
+        """
+        action = step["action"]
+        limit = step.get("max_iterations", MAX_ITERATIONS)
+        iterations = []
+        try:
+            if action == "parallel":
+                return await RecipeManager._run_parallel(engine, template, step, params, variables, limit)
+            
+            if action == "if":
+                matched = await engine.evaluate_condition(params)
+                results = await RecipeManager._run_block(engine, template, step.get("then" if matched else "else", []),
+                                                         variables)
+                success = all(r["result"]["success"] for r in results)
+                return ActionResult(success=success, action="if",
+                                    data={"matched": matched, "results": results},
+                                    error=None if success else "Falló un paso del bloque if")
+            
+            if action == "foreach":
+                name = step.get("as", "item")
+                selector = params.get("selector")
+                if selector:
+                    listing = await engine.get_elements(selector, params.get("fields"), limit)
+                    if not listing.success:
+                        return ActionResult(success=False, action="foreach", error=listing.error)
+                    items = listing.data["elements"]
+                else:
+                    items = params.get("items")
+                    if isinstance(items, str):
+                        items = json.loads(items)
+                    items = list(items or [])[:limit]
+                
+                for index, item in enumerate(items):
+                    variables[name] = item
+                    variables[f"{name}_index"] = index
+                    if selector:
+                        variables[f"{name}_selector"] = f"{selector} >> nth={index}"
+                    iterations.append({"iteration": index,
+                                       "results": await RecipeManager._run_block(engine, template, step["steps"],
+                                                                                 variables)})
+                    if not all(r["result"]["success"] for r in iterations[-1]["results"]):
+                        break
+            else:
+                # while comprueba antes de cada vuelta; until después (se ejecuta al menos una vez).
+                # La condición se vuelve a renderizar: puede depender de un save_as del cuerpo
+                while len(iterations) < limit:
+                    if action == "while" and not await engine.evaluate_condition(
+                            template.render(step["params"], variables)):
+                        break
+                    iterations.append({"iteration": len(iterations),
+                                       "results": await RecipeManager._run_block(engine, template, step["steps"],
+                                                                                 variables)})
+                    if not all(r["result"]["success"] for r in iterations[-1]["results"]):
+                        break
+                    if action == "until" and await engine.evaluate_condition(
+                            template.render(step["params"], variables)):
+                        break
+            
+            success = all(r["result"]["success"] for it in iterations for r in it["results"])
+            return ActionResult(
+                success=success,
+                action=action,
+                data={"iterations": len(iterations), "results": iterations},
+                error=None if success else f"Falló un paso en la iteración {len(iterations) - 1}"
+            )
+        except Exception as e:
+            return ActionResult(success=False, action=action, error=str(e),
+                                data={"iterations": len(iterations), "results": iterations})
+    
+    @staticmethod
+    def _step_targets(steps: List[Dict[str, Any]], field: str) -> set:
+        """Nombres de save_as o append_to (field) usados en unos pasos y sus sub-pasos."""
+        names = set()
+        for step in steps:
+            if step.get(field):
+                names.add(step[field])
+            for key in ("steps", "then", "else"):
+                names |= RecipeManager._step_targets(step.get(key, []), field)
+            for branch in step.get("branches", []):
+                names |= RecipeManager._step_targets(branch, field)
+        return names
+    
+    @staticmethod
+    async def _run_parallel(engine: 'AsyncBrowserController', template: RecipeTemplate, step: Dict[str, Any],
+                            params: Dict[str, Any], variables: Dict[str, Any], limit: int) -> ActionResult:
+        """
+        Ejecuta las ramas de un paso parallel a la vez, cada una en su propia pestaña.
+        
+        Las ramas son step["branches"] (listas de sub-pasos) o, como en foreach,
+        step["steps"] una vez por elemento de params.items / params.selector con
+        {{as}} y {{as_index}}. Las pestañas comparten el contexto (cookies, sesión)
+        y hay como mucho params.concurrency (4) abiertas. Cada rama trabaja sobre
+        una copia de las variables; al terminar, en orden de declaración, save_as
+        se copia a las variables del recipe y append_to concatena lo de cada rama.
+        Las variables propias de la rama ({{as}}, {{as_index}}) no salen de ella.
+        """
+        name = step.get("as", "item")
+        if "branches" in step:
+            branches = [(steps, {}) for steps in step["branches"]]
+            body = [s for steps in step["branches"] for s in steps]
+        else:
+            if params.get("selector"):
+                listing = await engine.get_elements(params["selector"], params.get("fields"), limit)
+                if not listing.success:
+                    return ActionResult(success=False, action="parallel", error=listing.error)
+                items = listing.data["elements"]
+            else:
+                items = params.get("items")
+                if isinstance(items, str):
+                    items = json.loads(items)
+                items = list(items or [])[:limit]
+            branches = [(step["steps"], {name: item, f"{name}_index": index}) for index, item in enumerate(items)]
+            body = step["steps"]
+        saved = RecipeManager._step_targets(body, "save_as")
+        appended = RecipeManager._step_targets(body, "append_to")
+        
+        concurrency = max(1, int(params.get("concurrency", 4)))
+        semaphore = asyncio.Semaphore(concurrency)
+        
+        async def run_branch(steps: List[Dict[str, Any]], bindings: Dict[str, Any]):
+            async with semaphore:
+                started = time.perf_counter()
+                branch_variables = dict(variables, **bindings)
+                tab = await engine.spawn(share_context=True)
+                try:
+                    results = await RecipeManager._run_block(tab, template, steps, branch_variables)
+                finally:
+                    await tab.stop()
+                return results, branch_variables, round((time.perf_counter() - started) * 1000, 2)
+        
+        outcomes = await asyncio.gather(*(run_branch(steps, bindings) for steps, bindings in branches),
+                                        return_exceptions=True)
+        
+        base = dict(variables)
+        report, failed = [], []
+        for index, outcome in enumerate(outcomes):
+            if isinstance(outcome, Exception):
+                report.append({"branch": index, "error": str(outcome), "results": []})
+                failed.append(index)
+                continue
+            results, branch_variables, elapsed_ms = outcome
+            report.append({"branch": index, "results": results, "elapsed_ms": elapsed_ms})
+            if not all(r["result"]["success"] for r in results):
+                failed.append(index)
+            for key in appended & branch_variables.keys():
+                added = list(branch_variables[key] or [])[len(base.get(key) or []):]
+                variables[key] = list(variables.get(key) or []) + added
+            for key in (saved - appended) & branch_variables.keys():
+                if branch_variables[key] is not base.get(key):
+                    variables[key] = branch_variables[key]
+        
+        return ActionResult(
+            success=not failed,
+            action="parallel",
+            data={"branches": len(branches), "concurrency": concurrency, "results": report},
+            error=f"Falló la rama {failed[0]}" if failed else None
+        )
+    
+    @staticmethod
+    def load_variable_sets(path: str) -> List[Dict[str, Any]]:
+        """Carga conjuntos de variables desde un archivo JSONL, CSV o JSON (lista)."""
+        with open(path, 'r', encoding='utf-8-sig', newline='') as f:
+            if path.lower().endswith('.csv'):
+                return [dict(row) for row in csv.DictReader(f)]
+            if path.lower().endswith('.json'):
+                return json.load(f)
+            return [json.loads(line) for line in f if line.strip()]
+    
+    @staticmethod
+    def run_batch(name: str, variable_sets: List[Dict[str, Any]], concurrency: int = 4,
+                  headless: bool = True, browser_type: str = "chromium",
+                  on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                  **engine_options) -> ActionResult:
+        """Ejecuta un recipe por lotes (envoltorio síncrono de run_batch_async)."""
+        return asyncio.run(RecipeManager.run_batch_async(
+            name, variable_sets, concurrency=concurrency, headless=headless,
+            browser_type=browser_type, on_result=on_result, **engine_options
+        ))
+    
+    @staticmethod
+    async def run_batch_async(name: str, variable_sets: List[Dict[str, Any]], concurrency: int = 4,
+                              headless: bool = True, browser_type: str = "chromium",
+                              on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                              **engine_options) -> ActionResult:
+        """
+        Ejecuta un recipe para muchos conjuntos de variables en paralelo.
+        
+        Un pool acotado de workers reparte los items sobre un único navegador; cada
+        item corre en su propio BrowserContext aislado. Los resultados se entregan a
+        on_result a medida que terminan y el fallo de un item no detiene al resto.
+        """
+        compile_result = RecipeManager.compile_recipe(name)
+        if not compile_result.success:
+            return compile_result
+        template: RecipeTemplate = compile_result.data["template"]
+        if not variable_sets:
+            return ActionResult(success=False, action="run_batch", error="No hay conjuntos de variables")
+        if not PLAYWRIGHT_AVAILABLE:
+            return ActionResult(
+                success=False,
+                action="run_batch",
+                error="Playwright no está instalado. Ejecuta: pip install playwright && playwright install"
+            )
+        
+        engine = AsyncBrowserController(headless=headless, browser_type=browser_type, **engine_options)
+        start_result = await engine.start()
+        if not start_result.success:
+            return start_result
+        
+        pending: "asyncio.Queue" = asyncio.Queue()
+        for index, variables in enumerate(variable_sets):
+            pending.put_nowait((index, variables))
+        succeeded = 0
+        
+        async def worker():
+            nonlocal succeeded
+            while True:
+                try:
+                    index, variables = pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                item = {"index": index, "variables": variables}
+                child = None
+                try:
+                    child = await engine.spawn()
+                    result = await RecipeManager.run_recipe_async(name, variables, engine=child)
+                    item.update(success=result.success, error=result.error, data=result.data)
+                except Exception as e:
+                    item.update(success=False, error=str(e), data=None)
+                finally:
+                    if child:
+                        await child.stop()
+                succeeded += 1 if item["success"] else 0
+                if on_result:
+                    on_result(item)
+        
+        workers = max(1, min(concurrency, len(variable_sets)))
+        try:
+            await asyncio.gather(*(worker() for _ in range(workers)))
+        finally:
+            await engine.stop()
+        
+        return ActionResult(
+            success=succeeded == len(variable_sets),
+            action="run_batch",
+            data={
+                "recipe_name": template.recipe.get("name"),
+                "items": len(variable_sets),
+                "succeeded": succeeded,
+                "failed": len(variable_sets) - succeeded,
+                "concurrency": workers
+            }
+        )
+    
+    @staticmethod
+    def run_sharded(name: str, variable_sets: List[Dict[str, Any]], processes: Optional[int] = None,
+                    concurrency: int = 2, browsers: Optional[List[str]] = None, headless: bool = True,
+                    on_result: Optional[Callable[[Dict[str, Any]], None]] = None,
+                    **engine_options) -> ActionResult:
+        """
+        Reparte un lote entre varios procesos, cada uno con su propio navegador.
+        
+        Cada shard (proceso) lanza su motor (browsers se asigna por turnos: chromium,
+        firefox, webkit) y corre hasta concurrency items a la vez en contextos
+        aislados. Los items salen de una cola compartida, así que los shards rápidos
+        hacen más trabajo. on_result recibe los items en el orden de entrada.
+        """
+        compile_result = RecipeManager.compile_recipe(name)
+        if not compile_result.success:
+            return compile_result
+        if not variable_sets:
+            return ActionResult(success=False, action="run_sharded", error="No hay conjuntos de variables")
+        if not PLAYWRIGHT_AVAILABLE:
+            return ActionResult(
+                success=False,
+                action="run_sharded",
+                error="Playwright no está instalado. Ejecuta: pip install playwright && playwright install"
+            )
+        
+        browsers = browsers or ["chromium"]
+        processes = max(1, min(processes or os.cpu_count() or 1, len(variable_sets)))
+        concurrency = max(1, concurrency)
+        # spawn: los hilos del proceso padre (daemon, loops) no se heredan a medias
+        mp = multiprocessing.get_context("spawn")
+        tasks, results = mp.Queue(), mp.Queue()
+        for index, variables in enumerate(variable_sets):
+            tasks.put((index, variables))
+        for _ in range(processes * concurrency):
+            tasks.put(None)
+        
+        shards = []
+        for shard in range(processes):
+            browser_type = browsers[shard % len(browsers)]
+            process = mp.Process(
+                target=_shard_worker,
+                args=(shard, name, browser_type, headless, concurrency, engine_options, tasks, results),
+                name=f"browser-shard-{shard}",
+                daemon=True
+            )
+            process.start()
+            shards.append({"shard": shard, "browser": browser_type, "process": process, "items": 0, "succeeded": 0})
+        
+        # Reordenar: un item se entrega cuando ya salieron todos los anteriores
+        buffered: Dict[int, Dict[str, Any]] = {}
+        next_index = 0
+        received = 0
+        succeeded = 0
+        finished = set()
+        while received < len(variable_sets):
+            try:
+                message = results.get(timeout=1.0)
+            except queue.Empty:
+                if all(not shard["process"].is_alive() for shard in shards):
+                    break
+                continue
+            if message.get("done"):
+                finished.add(message["shard"])
+                if message.get("error"):
+                    shards[message["shard"]]["error"] = message["error"]
+                continue
+            received += 1
+            shard = shards[message["shard"]]
+            shard["items"] += 1
+            if message["success"]:
+                shard["succeeded"] += 1
+                succeeded += 1
+            buffered[message["index"]] = message
+            while next_index in buffered:
+                item = buffered.pop(next_index)
+                next_index += 1
+                if on_result:
+                    on_result(item)
+        
+        # Items perdidos si un shard murió (p. ej. el navegador no arrancó)
+        for index in range(next_index, len(variable_sets)):
+            item = buffered.pop(index, None) or {
+                "index": index, "variables": variable_sets[index], "shard": None, "browser": None,
+                "success": False, "error": "El item no se procesó: terminaron todos los shards", "data": None
+            }
+            if on_result:
+                on_result(item)
+        
+        for shard in shards:
+            shard["process"].join(timeout=30)
+            if shard["process"].is_alive():
+                shard["process"].terminate()
+            del shard["process"]
+        # Si los shards murieron quedan items sin leer: el hilo que alimenta la cola
+        # seguiría bloqueado en la tubería y el intérprete no podría salir
+        tasks.cancel_join_thread()
+        tasks.close()
+        
+        return ActionResult(
+            success=succeeded == len(variable_sets),
+            action="run_sharded",
+            data={
+                "recipe_name": compile_result.data["template"].recipe.get("name"),
+                "items": len(variable_sets),
+                "succeeded": succeeded,
+                "failed": len(variable_sets) - succeeded,
+                "processes": processes,
+                "concurrency": concurrency,
+                "shards": shards
+            }
+        )
 
 
-class BrowserController:
-    """Controlador principal del navegador."""
+def _shard_worker(shard: int, name: str, browser_type: str, headless: bool, concurrency: int,
+                  engine_options: Dict[str, Any], tasks, results):
+    """Proceso de run_sharded: un navegador propio consumiendo items de la cola compartida."""
+    
+    async def serve():
+        har = engine_options.get("har")
+        if har and AsyncBrowserController._resolve_har_mode(os.path.abspath(har),
+                                                             engine_options.get("har_mode")) == "record":
+            # Los shards graban en paralelo: captura-shard0.har, captura-shard0-1.har...
+            stem, ext = os.path.splitext(har)
+            options = dict(engine_options, har=f"{stem}-shard{shard}{ext}", har_mode="record")
+        else:
+            options = engine_options
+        engine = AsyncBrowserController(headless=headless, browser_type=browser_type, **options)
+        start_result = await engine.start()
+        if not start_result.success:
+            results.put({"done": True, "shard": shard, "error": start_result.error})
+            return
+        loop = asyncio.get_running_loop()
+        
+        async def worker():
+            while True:
+                task = await loop.run_in_executor(None, tasks.get)
+                if task is None:
+                    return
+                index, variables = task
+                item = {"index": index, "variables": variables, "shard": shard, "browser": browser_type}
+                child = None
+                try:
+                    child = await engine.spawn()
+                    result = await RecipeManager.run_recipe_async(name, variables, engine=child)
+                    item.update(success=result.success, error=result.error, data=result.data)
+                except Exception as e:
+                    item.update(success=False, error=str(e), data=None)
+                finally:
+                    if child:
+                        await child.stop()
+                results.put(item)
+        
+        try:
+            await asyncio.gather(*(worker() for _ in range(concurrency)))
+        finally:
+            await engine.stop()
+        results.put({"done": True, "shard": shard})
+    
+    asyncio.run(serve())
+
+
+class SessionStore:
+    """
+    Perfiles de sesión con nombre: el storage_state de Playwright (cookies y
+    localStorage) guardado en disco con caducidad y un chequeo de validez opcional.
+    """
+    
+    @staticmethod
+    def get_path(name: str) -> str:
+        """Obtiene la ruta del archivo de un perfil."""
+        safe_name = re.sub(r'[^\w\s-]', '', name).strip().replace(' ', '-').lower()
+        return os.path.join(SESSIONS_DIR, f"{safe_name}.json")
+    
+    @staticmethod
+    def save(name: str, storage_state: Dict[str, Any], ttl: Optional[float] = SESSION_TTL,
+             check: Optional[Dict[str, Any]] = None) -> ActionResult:
+        """Guarda un storage_state bajo un nombre (escritura atómica, sólo legible por el usuario)."""
+        try:
+            now = datetime.now()
+            profile = {
+                "name": name,
+                "created_at": now.isoformat(),
+                "expires_at": datetime.fromtimestamp(now.timestamp() + ttl).isoformat() if ttl else None,
+                "check": check,
+                "storage_state": storage_state
+            }
+            path = SessionStore.get_path(name)
+            os.makedirs(SESSIONS_DIR, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=SESSIONS_DIR, suffix=".tmp")
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    json.dump(profile, f, indent=2, ensure_ascii=False)
+                os.chmod(tmp_path, 0o600)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+            
+            return ActionResult(
+                success=True,
+                action="save_session",
+                data={
+                    "name": name,
+                    "path": path,
+                    "expires_at": profile["expires_at"],
+                    "cookies": len(storage_state.get("cookies", [])),
+                    "origins": len(storage_state.get("origins", []))
+                }
+            )
+        except Exception as e:
+            return ActionResult(success=False, action="save_session", error=str(e))
+    
+    @staticmethod
+    def load(name: str) -> ActionResult:
+        """Carga un perfil vigente; descarta las cookies ya vencidas."""
+        try:
+            path = SessionStore.get_path(name)
+            if not os.path.exists(path):
+                return ActionResult(success=False, action="load_session", error=f"Sesión no encontrada: {name}")
+            with open(path, 'r', encoding='utf-8') as f:
+                profile = json.load(f)
+            
+            if profile.get("expires_at") and datetime.fromisoformat(profile["expires_at"]) <= datetime.now():
+                return ActionResult(success=False, action="load_session",
+                                    error=f"Sesión caducada: {name} ({profile['expires_at']})")
+            
+            state = profile["storage_state"]
+            now = time.time()
+            # expires = -1 son cookies de sesión del navegador: se conservan
+            state["cookies"] = [c for c in state.get("cookies", []) if not 0 <= c.get("expires", -1) <= now]
+            if not state["cookies"] and not state.get("origins"):
+                return ActionResult(success=False, action="load_session",
+                                    error=f"Sesión sin cookies vigentes: {name}")
+            return ActionResult(success=True, action="load_session", data=profile)
+        except Exception as e:
+            return ActionResult(success=False, action="load_session", error=str(e))
+    
+    @staticmethod
+    def list_sessions() -> ActionResult:
+        """Lista los perfiles guardados con su caducidad."""
+        try:
+            sessions = []
+            filenames = sorted(os.listdir(SESSIONS_DIR)) if os.path.isdir(SESSIONS_DIR) else []
+            now = datetime.now()
+            for filename in filenames:
+                if not filename.endswith(".json"):
+                    continue
+                with open(os.path.join(SESSIONS_DIR, filename), 'r', encoding='utf-8') as f:
+                    profile = json.load(f)
+                expires_at = profile.get("expires_at")
+                sessions.append({
+                    "name": profile.get("name"),
+                    "created_at": profile.get("created_at"),
+                    "expires_at": expires_at,
+                    "expired": bool(expires_at) and datetime.fromisoformat(expires_at) <= now,
+                    "cookies": len(profile.get("storage_state", {}).get("cookies", [])),
+                    "origins": [o.get("origin") for o in profile.get("storage_state", {}).get("origins", [])]
+                })
+            return ActionResult(
+                success=True,
+                action="list_sessions",
+                data={"count": len(sessions), "sessions": sessions}
+            )
+        except Exception as e:
+            return ActionResult(success=False, action="list_sessions", error=str(e))
     
-    def __init__(self, headless: bool = True, browser_type: str = "chromium"):
+    @staticmethod
+    def delete(name: str) -> ActionResult:
+        """Elimina un perfil."""
+        try:
+            path = SessionStore.get_path(name)
+            if not os.path.exists(path):
+                return ActionResult(success=False, action="delete_session", error=f"Sesión no encontrada: {name}")
+            os.remove(path)
+            return ActionResult(success=True, action="delete_session", data={"deleted": name})
+        except Exception as e:
+            return ActionResult(success=False, action="delete_session", error=str(e))
+
+
+class AsyncBrowserController:
+    """
+    Motor asíncrono del navegador sobre playwright.async_api.
+    
+    Expone las mismas acciones que BrowserController como corrutinas, por lo que
+    varias páginas y contextos pueden manejarse a la vez desde un mismo event loop.
+    """
+    
+    # Drivers de Playwright activos en este proceso
+    _drivers = 0
+    
+    def __init__(self, headless: bool = True, browser_type: str = "chromium",
+                 block: Optional[List[str]] = None, block_urls: Optional[List[str]] = None,
+                 har: Optional[str] = None, har_mode: Optional[str] = None,
+                 har_not_found: Optional[str] = None, recycle_actions: Optional[int] = None,
+                 recycle_rss_mb: Optional[float] = None, recycle_idle_s: Optional[float] = None,
+                 max_tabs: Optional[int] = None):
         self.headless = headless
         self.browser_type = browser_type
         self.playwright = None
-        self.browser: Optional[Browser] = None
-        self.context: Optional[BrowserContext] = None
-        self.page: Optional[Page] = None
+        self.browser: Optional['Browser'] = None
+        self.context: Optional['BrowserContext'] = None
+        self.page: Optional['Page'] = None
+        # Un controlador derivado con spawn() sólo cierra lo que creó
+        self._owns_browser = True
+        self._owns_context = True
+        # Bloqueo de red (perfiles + patrones de URL)
+        self.block: List[str] = []
+        self.block_urls: List[str] = []
+        self.blocked_requests = 0
+        self._blocked_types: set = set()
+        self._block_third_party = False
+        self._blocked_patterns: List[Any] = []
+        self._routed_context = None
+        self._configure_blocking(block or [], block_urls or [])
+        # HAR: record graba todo el tráfico del contexto, replay lo sirve desde el archivo
+        self.har = os.path.abspath(har) if har else None
+        self.har_mode = self._resolve_har_mode(self.har, har_mode)
+        self.har_not_found = har_not_found or "abort"
+        self._har_base = self.har
+        self._har_children = 0
+        self._har_spawned = False
+        # Requests vistas por el contexto que graba (un contexto sin tráfico no gasta archivo)
+        self._har_requests = 0
+        # Reciclado: contexto nuevo (con el mismo storage_state) tras N acciones, M MB o
+        # inactividad; las pestañas más antiguas se cierran por encima de max_tabs
+        self.recycle_actions = recycle_actions
+        self.recycle_rss_mb = recycle_rss_mb
+        self.recycle_idle_s = recycle_idle_s
+        self.max_tabs = max_tabs
+        self.actions = 0
+        self.actions_since_recycle = 0
+        self.recycles = 0
+        self.tabs_closed = 0
+        self.last_recycle: Optional[Dict[str, Any]] = None
+        self.last_action_at = time.monotonic()
+        self._rss_mb: Optional[float] = None
+        self._rss_checked_at = 0.0
+        self._last_recycle_at: Optional[float] = None
+        # Tras reciclar por RSS no se vuelve a disparar hasta que el RSS baje del umbral
+        self._rss_armed = True
+    
+    @staticmethod
+    def _resolve_har_mode(har: Optional[str], har_mode: Optional[str]) -> Optional[str]:
+        """auto (por defecto): replay si el HAR ya existe, record si no."""
+        if not har:
+            return None
+        if har_mode in (None, "auto"):
+            return "replay" if os.path.exists(har) else "record"
+        if har_mode not in ("record", "replay"):
+            raise ValueError(f"Modo HAR desconocido: {har_mode}. Disponibles: auto, record, replay")
+        return har_mode
+    
+    def options(self) -> Dict[str, Any]:
+        """Opciones de construcción, para crear motores equivalentes."""
+        return {
+            "headless": self.headless,
+            "browser_type": self.browser_type,
+            "block": list(self.block),
+            "block_urls": list(self.block_urls),
+            "har": self.har,
+            "har_mode": self.har_mode,
+            "har_not_found": self.har_not_found,
+            "recycle_actions": self.recycle_actions,
+            "recycle_rss_mb": self.recycle_rss_mb,
+            "recycle_idle_s": self.recycle_idle_s,
+            "max_tabs": self.max_tabs
+        }
         
-    def start(self) -> ActionResult:
+    async def _new_context(self, storage_state: Optional[Dict[str, Any]] = None) -> 'BrowserContext':
+        """Crea un BrowserContext con la configuración por defecto."""
+        har_options = {}
+        if self.har_mode == "record":
+            # El HAR se escribe al cerrar el contexto; .zip guarda los cuerpos como adjuntos
+            har_options = {
+                "record_har_path": self.har,
+                "record_har_mode": "full",
+                "record_har_content": "attach" if self.har.endswith(".zip") else "embed"
+            }
+        context = await self.browser.new_context(
+            viewport={"width": 1920, "height": 1080},
+            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+            storage_state=storage_state,
+            **har_options
+        )
+        if self.har_mode == "record":
+            self._har_requests = 0
+            context.on("request", self._count_har_request)
+        if self.block or self.block_urls:
+            await self._install_routing(context)
+        if self.har_mode == "replay":
+            # Registrado después del bloqueo, así que se consulta primero
+            await context.route_from_har(self.har, not_found=self.har_not_found)
+        return context
+    
+    def _configure_blocking(self, block: List[str], block_urls: List[str]):
+        """Valida perfiles y precompila las reglas de bloqueo."""
+        unknown = [name for name in block if name not in BLOCK_PROFILES]
+        if unknown:
+            raise ValueError(f"Perfil de bloqueo desconocido: {', '.join(unknown)}. "
+                             f"Disponibles: {', '.join(BLOCK_PROFILES)}")
+        self.block = list(block)
+        self.block_urls = list(block_urls)
+        self._blocked_types = {t for name in block for t in BLOCK_PROFILES[name].get("resource_types", [])}
+        self._block_third_party = any(BLOCK_PROFILES[name].get("third_party") for name in block)
+        self._blocked_patterns = [re.compile(fnmatch.translate(pattern)) for pattern in block_urls]
+    
+    async def _install_routing(self, context: 'BrowserContext'):
+        """Instala el handler de bloqueo en un contexto (una sola vez)."""
+        if self._routed_context is not context:
+            await context.route("**/*", self._route_request)
+            self._routed_context = context
+    
+    def _should_block(self, request) -> bool:
+        """Decide si una petición se aborta según las reglas activas."""
+        if request.resource_type in self._blocked_types:
+            return True
+        url = request.url
+        if any(pattern.match(url) for pattern in self._blocked_patterns):
+            return True
+        if self._block_third_party and request.resource_type != "document":
+            try:
+                page_url = request.frame.page.url
+            except Exception:
+                return False
+            if page_url.startswith("http"):
+                return _site(url) != _site(page_url)
+        return False
+    
+    async def _route_request(self, route):
+        """Handler de red: aborta lo bloqueado y deja pasar el resto."""
+        if self._should_block(route.request):
+            self.blocked_requests += 1
+            await route.abort("blockedbyclient")
+        else:
+            await route.fallback()
+    
+    async def set_blocking(self, block: Optional[List[str]] = None,
+                           block_urls: Optional[List[str]] = None) -> ActionResult:
+        """Cambia los perfiles de bloqueo y patrones de URL del contexto actual."""
+        try:
+            if isinstance(block, str):
+                block = [name.strip() for name in block.split(",") if name.strip()]
+            if isinstance(block_urls, str):
+                block_urls = [block_urls]
+            self._configure_blocking(block or [], block_urls or [])
+            if self.context and (self.block or self.block_urls):
+                await self._install_routing(self.context)
+            return ActionResult(
+                success=True,
+                action="block_resources",
+                data={"block": self.block, "block_urls": self.block_urls,
+                      "blocked_requests": self.blocked_requests}
+            )
+        except Exception as e:
+            return ActionResult(success=False, action="block_resources", error=str(e))
+    
+    async def start(self) -> ActionResult:
         """Inicia el navegador."""
         if not PLAYWRIGHT_AVAILABLE:
             return ActionResult(
@@ -295,7 +2100,9 @@ class BrowserController:
             )
         
         try:
-            self.playwright = sync_playwright().start()
+            from playwright.async_api import async_playwright
+            self.playwright = await async_playwright().start()
+            AsyncBrowserController._drivers += 1
             
             if self.browser_type == "firefox":
                 browser_class = self.playwright.firefox
@@ -304,44 +2111,305 @@ class BrowserController:
             else:
                 browser_class = self.playwright.chromium
             
-            self.browser = browser_class.launch(headless=self.headless)
-            self.context = self.browser.new_context(
-                viewport={"width": 1920, "height": 1080},
-                user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-            )
-            self.page = self.context.new_page()
+            self.browser = await browser_class.launch(headless=self.headless)
+            self.context = await self._new_context()
+            self.page = await self.context.new_page()
             
+            data = {"browser": self.browser_type, "headless": self.headless}
+            if self.har:
+                data.update(har=self.har, har_mode=self.har_mode)
             return ActionResult(
                 success=True,
                 action="start",
-                data={"browser": self.browser_type, "headless": self.headless}
+                data=data
+            )
+        except Exception as e:
+            return ActionResult(success=False, action="start", error=str(e))
+    
+    async def reset_context(self) -> ActionResult:
+        """Reemplaza el contexto actual por uno limpio (sin cookies ni pestañas)."""
+        try:
+            if self.context:
+                await self.context.close()
+            self.context = await self._new_context()
+            self.page = await self.context.new_page()
+            return ActionResult(success=True, action="reset_context")
+        except Exception as e:
+            return ActionResult(success=False, action="reset_context", error=str(e))
+    
+    async def save_session(self, name: str, ttl: Optional[float] = SESSION_TTL,
+                           check: Optional[Dict[str, Any]] = None) -> ActionResult:
+        """Guarda cookies y localStorage del contexto actual como perfil de sesión."""
+        try:
+            state = await self.context.storage_state()
+        except Exception as e:
+            return ActionResult(success=False, action="save_session", error=str(e))
+        return SessionStore.save(name, state, ttl, check)
+    
+    async def load_session(self, name: str, check: Optional[Dict[str, Any]] = None) -> ActionResult:
+        """
+        Reemplaza el contexto por uno con el storage_state de un perfil.
+        
+        check ({"url": ..., "selector": ...}, por defecto el guardado con el perfil)
+        verifica que la sesión sigue activa: navega a url y espera selector. Si la
+        verificación falla se vuelve a un contexto limpio y la acción falla.
+        """
+        profile_result = SessionStore.load(name)
+        if not profile_result.success:
+            return profile_result
+        profile = profile_result.data
+        check = check or profile.get("check")
+        
+        try:
+            await self._replace_context(profile["storage_state"])
+            
+            if check and check.get("selector"):
+                if check.get("url"):
+                    await self.page.goto(check["url"], wait_until="domcontentloaded")
+                try:
+                    await self.page.wait_for_selector(check["selector"], timeout=check.get("timeout", 5000))
+                except Exception:
+                    await self.reset_context()
+                    return ActionResult(
+                        success=False,
+                        action="load_session",
+                        error=f"Sesión inválida: {name} (no aparece {check['selector']})"
+                    )
+            
+            return ActionResult(
+                success=True,
+                action="load_session",
+                data={
+                    "name": name,
+                    "expires_at": profile.get("expires_at"),
+                    "cookies": len(profile["storage_state"].get("cookies", [])),
+                    "checked": bool(check and check.get("selector"))
+                },
+                url=self.page.url,
+                title=await self.page.title()
             )
         except Exception as e:
-            return ActionResult(success=False, action="start", error=str(e))
+            return ActionResult(success=False, action="load_session", error=str(e))
+    
+    def _next_har_path(self) -> str:
+        """Archivo para el siguiente contexto grabado: captura-1.har, captura-2.har..."""
+        self._har_children += 1
+        stem, ext = os.path.splitext(self._har_base)
+        return f"{stem}-{self._har_children}{ext}"
+    
+    async def _close_context(self):
+        """Cierra el contexto propio (con record_har_path, es aquí donde se escribe el HAR)."""
+        if hasattr(self.context, "unroute_all"):
+            await self.context.unroute_all(behavior="ignoreErrors")
+        await self.context.close()
+    
+    def _count_har_request(self, request):
+        self._har_requests += 1
+    
+    async def _replace_context(self, storage_state: Optional[Dict[str, Any]] = None):
+        """Cambia el contexto propio por uno nuevo con el storage_state dado."""
+        if self.context and self._owns_context:
+            await self._close_context()
+            if self.har_mode == "record" and self._har_requests:
+                # El contexto cerrado ya escribió su HAR; el nuevo graba en otro archivo.
+                # Si no grabó nada (load_session o --resume al empezar), el nuevo reutiliza
+                # el archivo: si no, el modo auto reproduciría después un HAR vacío
+                self.har = self._next_har_path()
+        self.context = await self._new_context(storage_state=storage_state)
+        self._owns_context = True
+        self.page = await self.context.new_page()
+    
+    async def restore_state(self, storage_state: Dict[str, Any], url: Optional[str] = None) -> ActionResult:
+        """Restaura cookies/localStorage en un contexto nuevo y vuelve a la URL guardada."""
+        try:
+            await self._replace_context(storage_state)
+            if url and url != "about:blank":
+                await self.page.goto(url, wait_until="domcontentloaded")
+            return ActionResult(success=True, action="restore_state", url=self.page.url,
+                                title=await self.page.title())
+        except Exception as e:
+            return ActionResult(success=False, action="restore_state", error=str(e))
+    
+    def browser_rss_mb(self, refresh: bool = False) -> Optional[float]:
+        """
+        RSS de los navegadores lanzados por este proceso (cacheado RSS_CHECK_INTERVAL s).
+        
+        Con un solo navegador en el proceso son todos sus descendientes. Con varios
+        (sesiones del daemon) se intenta atribuirlo al driver de este motor, cuyo
+        pid Playwright no expone públicamente; si falla, se usa el total del proceso.
+        """
+        now = time.monotonic()
+        if refresh or now - self._rss_checked_at >= RSS_CHECK_INTERVAL:
+            root, include_root = os.getpid(), False
+            if AsyncBrowserController._drivers > 1:
+                try:
+                    root, include_root = self.playwright._impl_obj._connection._transport._proc.pid, True
+                except AttributeError:
+                    pass
+            rss_kb = _process_tree_rss_kb(root, include_root)
+            self._rss_mb = round(rss_kb / 1024, 1) if rss_kb is not None else None
+            self._rss_checked_at = now
+        return self._rss_mb
+    
+    def resource_metrics(self) -> Dict[str, Any]:
+        """Métricas de recursos y de reciclado del motor."""
+        return {
+            "rss_mb": self.browser_rss_mb(),
+            "tabs": len(self.context.pages) if self.context else 0,
+            "contexts": len(self.browser.contexts) if self.browser else 0,
+            "actions": self.actions,
+            "actions_since_recycle": self.actions_since_recycle,
+            "idle_s": round(time.monotonic() - self.last_action_at, 1),
+            "recycles": self.recycles,
+            "tabs_closed": self.tabs_closed,
+            "last_recycle": self.last_recycle,
+            "limits": {
+                "recycle_actions": self.recycle_actions,
+                "recycle_rss_mb": self.recycle_rss_mb,
+                "recycle_idle_s": self.recycle_idle_s,
+                "max_tabs": self.max_tabs
+            }
+        }
+    
+    async def recycle(self, reason: str = "manual") -> ActionResult:
+        """
+        Reemplaza el contexto por uno nuevo conservando cookies, localStorage y URL.
+        
+        Libera la memoria acumulada por pestañas, listeners y caches del contexto
+        sin perder la sesión. Un derivado que comparte contexto no recicla.
+        """
+        if not self._owns_context or not self.context:
+            return ActionResult(success=False, action="recycle", error="El contexto no pertenece a este controlador")
+        try:
+            rss_before = self.browser_rss_mb(refresh=True)
+            url = self.page.url if self.page else None
+            state = await self.context.storage_state()
+            restore_result = await self.restore_state(state, url)
+            if not restore_result.success:
+                return ActionResult(success=False, action="recycle", error=restore_result.error)
+            self.recycles += 1
+            self.actions_since_recycle = 0
+            self._last_recycle_at = time.monotonic()
+            self.last_recycle = {
+                "reason": reason,
+                "at": datetime.now().isoformat(),
+                "rss_before_mb": rss_before,
+                "rss_after_mb": self.browser_rss_mb(refresh=True)
+            }
+            return ActionResult(success=True, action="recycle", data=self.last_recycle,
+                                url=restore_result.url, title=restore_result.title)
+        except Exception as e:
+            return ActionResult(success=False, action="recycle", error=str(e))
     
-    def stop(self) -> ActionResult:
-        """Cierra el navegador."""
+    def _recycle_reason(self) -> Optional[str]:
+        """Umbral de reciclado alcanzado, si lo hay."""
+        now = time.monotonic()
+        rss = self.browser_rss_mb() if self.recycle_rss_mb else None
+        if rss is not None and rss < self.recycle_rss_mb:
+            self._rss_armed = True
+        if self._last_recycle_at is not None and now - self._last_recycle_at < RECYCLE_MIN_INTERVAL:
+            return None
+        idle = now - self.last_action_at
+        if self.recycle_idle_s and self.actions_since_recycle and idle >= self.recycle_idle_s:
+            return f"idle {idle:.0f}s"
+        if self.recycle_actions and self.actions_since_recycle >= self.recycle_actions:
+            return f"{self.actions_since_recycle} acciones"
+        if rss is not None and self._rss_armed and rss >= self.recycle_rss_mb:
+            self._rss_armed = False
+            return f"rss {rss} MB"
+        return None
+    
+    async def maybe_recycle(self) -> Optional[ActionResult]:
+        """
+        Aplica los umbrales de reciclado y max_tabs; se llama entre peticiones.
+        
+        Nunca a mitad de un recipe: reciclar descartaría formularios, handlers de
+        diálogo y observers de pasos anteriores. Devuelve el resultado del
+        reciclado o None si no hizo falta.
+        """
+        if not self._owns_context or not self.context:
+            return None
+        reason = self._recycle_reason()
+        result = await self.recycle(reason) if reason else None
+        
+        if self.max_tabs and len(self.context.pages) > self.max_tabs:
+            # Cerrar las pestañas más antiguas, nunca la actual
+            extra = [page for page in self.context.pages if page is not self.page]
+            for page in extra[:len(self.context.pages) - self.max_tabs]:
+                await page.close()
+                self.tabs_closed += 1
+        return result
+    
+    async def spawn(self, share_context: bool = False) -> 'AsyncBrowserController':
+        """
+        Crea un controlador derivado sobre el mismo navegador.
+        
+        Por defecto el derivado tiene su propio BrowserContext aislado; con
+        share_context=True comparte el contexto y sólo abre una pestaña nueva.
+        """
+        child = AsyncBrowserController(**self.options())
+        child.playwright = self.playwright
+        child.browser = self.browser
+        child._owns_browser = False
+        if self.har_mode == "record" and not share_context:
+            # Cada contexto grabado necesita su propio archivo: captura-1.har, captura-2.har...
+            child.har = child._har_base = self._next_har_path()
+            self._har_spawned = True
+        if share_context:
+            child.context = self.context
+            child._owns_context = False
+            child._routed_context = self._routed_context
+        else:
+            child.context = await child._new_context()
+        child.page = await child.context.new_page()
+        return child
+    
+    async def stop(self) -> ActionResult:
+        """Cierra el navegador (o sólo el contexto/pestaña de un derivado)."""
         try:
+            if not self._owns_browser:
+                if self._owns_context and self.context:
+                    await self._close_context()
+                elif self.page and not self.page.is_closed():
+                    await self.page.close()
+                return ActionResult(success=True, action="stop")
+            if self._owns_context and self.context:
+                # Un lote sólo usa el contexto principal para derivar los que graban: su HAR
+                # vacío haría que la siguiente ejecución en modo auto reprodujera nada
+                parent_only = (self.har_mode == "record" and self._har_spawned
+                               and self.page and self.page.url == "about:blank")
+                await self._close_context()
+                if parent_only and os.path.exists(self.har):
+                    os.remove(self.har)
             if self.browser:
-                self.browser.close()
+                await self.browser.close()
             if self.playwright:
-                self.playwright.stop()
+                await self.playwright.stop()
+                self.playwright = None
+                AsyncBrowserController._drivers -= 1
             return ActionResult(success=True, action="stop")
         except Exception as e:
             return ActionResult(success=False, action="stop", error=str(e))
     
-    def execute_action(self, action: str, params: Dict[str, Any]) -> ActionResult:
+    async def execute_action(self, action: str, params: Dict[str, Any]) -> ActionResult:
         """Ejecuta una acción con parámetros dinámicos."""
         action_map = {
-            "navigate": lambda: self.navigate(params.get("url"), params.get("wait_until", "networkidle")),
+            "navigate": lambda: self.navigate(params.get("url"), params.get("wait_until", "auto"),
+                                              params.get("ready_selector"), params.get("ready_js"),
+                                              params.get("dom_idle_ms"), params.get("ready_timeout", 10000)),
             "click": lambda: self.click(params.get("selector"), params.get("timeout", 5000)),
             "fill": lambda: self.fill(params.get("selector"), params.get("text"), params.get("timeout", 5000)),
             "type": lambda: self.type_text(params.get("selector"), params.get("text"), 
                                            params.get("delay", 50), params.get("timeout", 5000)),
             "press_key": lambda: self.press_key(params.get("key")),
             "wait_for_selector": lambda: self.wait_for_selector(params.get("selector"), params.get("timeout", 5000)),
-            "wait_for_load": lambda: self.wait_for_load(params.get("state", "networkidle")),
-            "screenshot": lambda: self.screenshot(params.get("full_page", False), params.get("selector")),
+            "wait_for_load": lambda: self.wait_for_load(params.get("state", "auto"), params.get("ready_selector"),
+                                                        params.get("ready_js"), params.get("dom_idle_ms"),
+                                                        params.get("ready_timeout", 10000)),
+            "screenshot": lambda: self.screenshot(params.get("full_page", False), params.get("selector"),
+                                                  params.get("path"), params.get("dir"),
+                                                  params.get("format", "png"), params.get("quality"),
+                                                  params.get("clip")),
             "get_text": lambda: self.get_text(params.get("selector")),
             "get_html": lambda: self.get_html(params.get("selector")),
             "evaluate": lambda: self.evaluate(params.get("script")),
@@ -350,7 +2418,30 @@ class BrowserController:
             "select_option": lambda: self.select_option(params.get("selector"), params.get("value"), 
                                                           params.get("label"), params.get("index")),
             "get_attribute": lambda: self.get_attribute(params.get("selector"), params.get("attribute")),
-            "get_elements": lambda: self.get_elements(params.get("selector")),
+            "get_elements": lambda: self.get_elements(params.get("selector"), params.get("fields"),
+                                                      params.get("limit"), params.get("offset", 0),
+                                                      params.get("max_text", 100)),
+            "extract": lambda: self.extract(params.get("schema"), params.get("next"),
+                                            params.get("max_pages", 1),
+                                            params.get("output", params.get("path")),
+                                            params.get("timeout", 5000)),
+            "harvest": lambda: self.harvest(params.get("selector"), params.get("schema"), params.get("key"),
+                                            params.get("max_items", params.get("limit")),
+                                            params.get("idle_scrolls", 3), params.get("time_budget", 30000),
+                                            params.get("growth_timeout", 3000),
+                                            params.get("output", params.get("path")),
+                                            params.get("reset", False)),
+            "performance_metrics": lambda: self.performance_metrics(params.get("waterfall", params.get("path")),
+                                                                    params.get("top", params.get("limit", 5))),
+            "watch_dom": lambda: self.watch_dom(params.get("selector"), params.get("reset", False),
+                                                params.get("wait_ms", 0), params.get("max_text", 200),
+                                                params.get("max_changes", 1000), params.get("html", False)),
+            "recycle": lambda: self.recycle(params.get("reason", "manual")),
+            "block_resources": lambda: self.set_blocking(params.get("block"), params.get("block_urls")),
+            "save_session": lambda: self.save_session(params.get("name"), params.get("ttl", SESSION_TTL),
+                                                      params.get("check") or self._session_check(params)),
+            "load_session": lambda: self.load_session(params.get("name"),
+                                                      params.get("check") or self._session_check(params)),
             "go_back": lambda: self.go_back(),
             "go_forward": lambda: self.go_forward(),
             "reload": lambda: self.reload(),
@@ -368,46 +2459,136 @@ class BrowserController:
         }
         
         if action in action_map:
-            return action_map[action]()
+            self.actions += 1
+            self.actions_since_recycle += 1
+            try:
+                return await action_map[action]()
+            finally:
+                self.last_action_at = time.monotonic()
         else:
             return ActionResult(success=False, action=action, error=f"Acción desconocida: {action}")
     
-    def sleep(self, seconds: float) -> ActionResult:
+    async def evaluate_condition(self, condition: Dict[str, Any]) -> bool:
+        """
+        Evalúa la condición de un paso while/until/if.
+        
+        selector: existe algún match; visible: el primer match es visible; js:
+        expresión verdadera; value: valor (ya renderizado) no vacío. "not": true
+        invierte el resultado.
+        """
+        if condition.get("selector"):
+            matched = await self.page.locator(condition["selector"]).count() > 0
+        elif condition.get("visible"):
+            matched = await self.page.locator(condition["visible"]).first.is_visible()
+        elif condition.get("js"):
+            matched = bool(await self.page.evaluate(condition["js"]))
+        else:
+            matched = bool(condition.get("value"))
+        return matched != bool(condition.get("not"))
+    
+    @staticmethod
+    def _session_check(params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Chequeo de sesión a partir de los params planos url/selector."""
+        if not params.get("selector"):
+            return None
+        return {"url": params.get("url"), "selector": params["selector"], "timeout": params.get("timeout", 5000)}
+    
+    async def sleep(self, seconds: float) -> ActionResult:
         """Pausa la ejecución."""
-        import time
-        time.sleep(seconds)
+        await asyncio.sleep(seconds)
         return ActionResult(success=True, action="sleep", data={"seconds": seconds})
     
-    def navigate(self, url: str, wait_until: str = "networkidle") -> ActionResult:
-        """Navega a una URL."""
+    async def navigate(self, url: str, wait_until: str = "auto",
+                       ready_selector: Optional[str] = None, ready_js: Optional[str] = None,
+                       dom_idle_ms: Optional[int] = None, ready_timeout: int = 10000) -> ActionResult:
+        """
+        Navega a una URL.
+        
+        Con wait_until="auto" (por defecto) espera a domcontentloaded y después a la
+        primera condición de carga que se cumpla: ready_selector visible, ready_js
+        verdadero o el DOM sin mutaciones durante dom_idle_ms.
+        """
         try:
-            self.page.goto(url, wait_until=wait_until)
+            started = time.monotonic()
+            goto_state = "domcontentloaded" if wait_until == "auto" else wait_until
+            await self.page.goto(url, wait_until=goto_state)
+            data = {
+                "wait_until": wait_until,
+                "navigation_ms": round((time.monotonic() - started) * 1000, 1)
+            }
+            if wait_until == "auto":
+                data.update(await self._wait_ready(ready_selector, ready_js, dom_idle_ms, ready_timeout))
             return ActionResult(
                 success=True,
                 action="navigate",
+                data=data,
                 url=self.page.url,
-                title=self.page.title()
+                title=await self.page.title()
             )
         except Exception as e:
             return ActionResult(success=False, action="navigate", error=str(e))
     
-    def click(self, selector: str, timeout: int = 5000) -> ActionResult:
+    async def _wait_ready(self, selector: Optional[str] = None, predicate: Optional[str] = None,
+                          dom_idle_ms: Optional[int] = None, timeout: int = 10000) -> Dict[str, Any]:
+        """
+        Espera a la primera condición de carga que se cumpla.
+        
+        Devuelve qué condición resolvió (ready_by), si se cumplió alguna (ready) y
+        cuánto se esperó en realidad (waited_ms). Sin condiciones no espera nada más
+        allá de domcontentloaded.
+        """
+        started = time.monotonic()
+        conditions = {}
+        if selector:
+            conditions["selector"] = self.page.wait_for_selector(selector, timeout=timeout)
+        if predicate:
+            conditions["predicate"] = self.page.wait_for_function(predicate, timeout=timeout)
+        if dom_idle_ms:
+            conditions["dom_idle"] = self.page.evaluate(DOM_IDLE_JS, {"idle": dom_idle_ms, "timeout": timeout})
+        if not conditions:
+            return {"ready": True, "ready_by": "domcontentloaded", "waited_ms": 0}
+        
+        tasks = {asyncio.ensure_future(condition): name for name, condition in conditions.items()}
+        pending = set(tasks)
+        ready_by = None
+        deadline = started + timeout / 1000
+        while pending and ready_by is None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                # dom_idle devuelve False si el DOM nunca se calmó antes del timeout
+                if task.exception() is None and task.result() is not False:
+                    ready_by = tasks[task]
+                    break
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        
+        return {
+            "ready": ready_by is not None,
+            "ready_by": ready_by or "domcontentloaded",
+            "waited_ms": round((time.monotonic() - started) * 1000, 1)
+        }
+    
+    async def click(self, selector: str, timeout: int = 5000) -> ActionResult:
         """Hace clic en un elemento."""
         try:
-            self.page.click(selector, timeout=timeout)
+            await self.page.click(selector, timeout=timeout)
             return ActionResult(
                 success=True,
                 action="click",
                 url=self.page.url,
-                title=self.page.title()
+                title=await self.page.title()
             )
         except Exception as e:
             return ActionResult(success=False, action="click", error=str(e))
     
-    def fill(self, selector: str, text: str, timeout: int = 5000) -> ActionResult:
+    async def fill(self, selector: str, text: str, timeout: int = 5000) -> ActionResult:
         """Llena un campo de texto."""
         try:
-            self.page.fill(selector, text, timeout=timeout)
+            await self.page.fill(selector, text, timeout=timeout)
             return ActionResult(
                 success=True,
                 action="fill",
@@ -416,10 +2597,10 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="fill", error=str(e))
     
-    def type_text(self, selector: str, text: str, delay: int = 50, timeout: int = 5000) -> ActionResult:
+    async def type_text(self, selector: str, text: str, delay: int = 50, timeout: int = 5000) -> ActionResult:
         """Escribe texto carácter por carácter (simula tipeo humano)."""
         try:
-            self.page.type(selector, text, delay=delay, timeout=timeout)
+            await self.page.type(selector, text, delay=delay, timeout=timeout)
             return ActionResult(
                 success=True,
                 action="type",
@@ -428,10 +2609,10 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="type", error=str(e))
     
-    def press_key(self, key: str) -> ActionResult:
+    async def press_key(self, key: str) -> ActionResult:
         """Presiona una tecla especial (Enter, Escape, etc.)."""
         try:
-            self.page.press("body", key)
+            await self.page.press("body", key)
             return ActionResult(
                 success=True,
                 action="press_key",
@@ -440,10 +2621,10 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="press_key", error=str(e))
     
-    def wait_for_selector(self, selector: str, timeout: int = 5000) -> ActionResult:
+    async def wait_for_selector(self, selector: str, timeout: int = 5000) -> ActionResult:
         """Espera a que un elemento aparezca."""
         try:
-            element = self.page.wait_for_selector(selector, timeout=timeout)
+            element = await self.page.wait_for_selector(selector, timeout=timeout)
             return ActionResult(
                 success=True,
                 action="wait_for_selector",
@@ -452,32 +2633,93 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="wait_for_selector", error=str(e))
     
-    def wait_for_load(self, state: str = "networkidle") -> ActionResult:
-        """Espera a que la página cargue."""
+    async def wait_for_load(self, state: str = "auto", ready_selector: Optional[str] = None,
+                            ready_js: Optional[str] = None, dom_idle_ms: Optional[int] = None,
+                            ready_timeout: int = 10000) -> ActionResult:
+        """Espera a que la página cargue ("auto" = domcontentloaded + condiciones de carga)."""
         try:
-            self.page.wait_for_load_state(state)
+            started = time.monotonic()
+            await self.page.wait_for_load_state("domcontentloaded" if state == "auto" else state)
+            data = {"state": state}
+            if state == "auto":
+                data.update(await self._wait_ready(ready_selector, ready_js, dom_idle_ms, ready_timeout))
+            data["waited_ms"] = round((time.monotonic() - started) * 1000, 1)
             return ActionResult(
                 success=True,
                 action="wait_for_load",
-                data={"state": state}
+                data=data
             )
         except Exception as e:
             return ActionResult(success=False, action="wait_for_load", error=str(e))
     
-    def screenshot(self, full_page: bool = False, selector: Optional[str] = None) -> ActionResult:
-        """Toma una captura de pantalla."""
+    async def screenshot(self, full_page: bool = False, selector: Optional[str] = None,
+                         path: Optional[str] = None, directory: Optional[str] = None,
+                         format: str = "png", quality: Optional[int] = None,
+                         clip: Optional[Any] = None) -> ActionResult:
+        """
+        Toma una captura de pantalla.
+        
+        Con path o directory la imagen se escribe directamente a disco y el resultado
+        sólo lleva la ruta y metadatos; sin ellos se devuelve en base64 como antes.
+        """
         try:
+            image_format = SCREENSHOT_FORMATS.get((format or "png").lower())
+            if not image_format:
+                return ActionResult(
+                    success=False,
+                    action="screenshot",
+                    error=f"Formato no soportado: {format}. Usa png, jpeg o webp"
+                )
+            if isinstance(clip, str):
+                clip = dict(zip(("x", "y", "width", "height"), (float(v) for v in clip.split(","))))
+            
+            element = None
             if selector:
-                element = self.page.query_selector(selector)
+                element = await self.page.query_selector(selector)
                 if not element:
                     return ActionResult(
                         success=False,
                         action="screenshot",
                         error=f"Elemento no encontrado: {selector}"
                     )
-                screenshot_bytes = element.screenshot()
+            
+            if image_format == "webp":
+                screenshot_bytes = await self._capture_webp(element, full_page, quality, clip)
             else:
-                screenshot_bytes = self.page.screenshot(full_page=full_page)
+                options = {"type": image_format}
+                if image_format == "jpeg" and quality is not None:
+                    options["quality"] = int(quality)
+                if element:
+                    screenshot_bytes = await element.screenshot(**options)
+                else:
+                    screenshot_bytes = await self.page.screenshot(full_page=full_page, clip=clip, **options)
+            
+            if path or directory:
+                if not path:
+                    extension = "jpg" if image_format == "jpeg" else image_format
+                    path = os.path.join(
+                        _screenshot_dir(directory),
+                        f"screenshot-{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.{extension}"
+                    )
+                path = os.path.abspath(path)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(screenshot_bytes)
+                
+                return ActionResult(
+                    success=True,
+                    action="screenshot",
+                    data={
+                        "path": path,
+                        "format": image_format,
+                        "bytes": len(screenshot_bytes),
+                        "full_page": full_page,
+                        "selector": selector,
+                        "clip": clip
+                    },
+                    url=self.page.url,
+                    title=await self.page.title()
+                )
             
             screenshot_b64 = base64.b64encode(screenshot_bytes).decode('utf-8')
             
@@ -486,25 +2728,56 @@ class BrowserController:
                 action="screenshot",
                 screenshot=screenshot_b64,
                 url=self.page.url,
-                title=self.page.title()
+                title=await self.page.title()
             )
         except Exception as e:
             return ActionResult(success=False, action="screenshot", error=str(e))
     
-    def get_text(self, selector: Optional[str] = None) -> ActionResult:
+    async def _capture_webp(self, element, full_page: bool, quality: Optional[int],
+                            clip: Optional[Dict[str, float]]) -> bytes:
+        """Captura en WebP vía CDP (Playwright sólo soporta png/jpeg)."""
+        if self.browser_type != "chromium":
+            raise ValueError("El formato webp sólo está disponible en Chromium")
+        
+        params: Dict[str, Any] = {"format": "webp"}
+        if quality is not None:
+            params["quality"] = int(quality)
+        if element:
+            await element.scroll_into_view_if_needed()
+            box = await element.bounding_box()
+            scroll_x, scroll_y = await self.page.evaluate("[window.scrollX, window.scrollY]")
+            clip = {"x": box["x"] + scroll_x, "y": box["y"] + scroll_y,
+                    "width": box["width"], "height": box["height"]}
+        elif full_page and not clip:
+            width, height = await self.page.evaluate(
+                "[document.documentElement.scrollWidth, document.documentElement.scrollHeight]"
+            )
+            clip = {"x": 0, "y": 0, "width": width, "height": height}
+            params["captureBeyondViewport"] = True
+        if clip:
+            params["clip"] = dict(clip, scale=1)
+        
+        session = await self.context.new_cdp_session(self.page)
+        try:
+            response = await session.send("Page.captureScreenshot", params)
+        finally:
+            await session.detach()
+        return base64.b64decode(response["data"])
+    
+    async def get_text(self, selector: Optional[str] = None) -> ActionResult:
         """Extrae texto de la página o de un elemento específico."""
         try:
             if selector:
-                element = self.page.query_selector(selector)
+                element = await self.page.query_selector(selector)
                 if not element:
                     return ActionResult(
                         success=False,
                         action="get_text",
                         error=f"Elemento no encontrado: {selector}"
                     )
-                text = element.inner_text()
+                text = await element.inner_text()
             else:
-                text = self.page.inner_text("body")
+                text = await self.page.inner_text("body")
             
             return ActionResult(
                 success=True,
@@ -514,20 +2787,20 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="get_text", error=str(e))
     
-    def get_html(self, selector: Optional[str] = None) -> ActionResult:
+    async def get_html(self, selector: Optional[str] = None) -> ActionResult:
         """Obtiene el HTML de la página o de un elemento."""
         try:
             if selector:
-                element = self.page.query_selector(selector)
+                element = await self.page.query_selector(selector)
                 if not element:
                     return ActionResult(
                         success=False,
                         action="get_html",
                         error=f"Elemento no encontrado: {selector}"
                     )
-                html = element.inner_html()
+                html = await element.inner_html()
             else:
-                html = self.page.content()
+                html = await self.page.content()
             
             return ActionResult(
                 success=True,
@@ -537,10 +2810,10 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="get_html", error=str(e))
     
-    def evaluate(self, script: str) -> ActionResult:
+    async def evaluate(self, script: str) -> ActionResult:
         """Ejecuta JavaScript en la página."""
         try:
-            result = self.page.evaluate(script)
+            result = await self.page.evaluate(script)
             return ActionResult(
                 success=True,
                 action="evaluate",
@@ -549,19 +2822,19 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="evaluate", error=str(e))
     
-    def scroll(self, direction: str = "down", amount: int = 500) -> ActionResult:
+    async def scroll(self, direction: str = "down", amount: int = 500) -> ActionResult:
         """Hace scroll en la página."""
         try:
             if direction == "down":
-                self.page.evaluate(f"window.scrollBy(0, {amount})")
+                await self.page.evaluate(f"window.scrollBy(0, {amount})")
             elif direction == "up":
-                self.page.evaluate(f"window.scrollBy(0, -{amount})")
+                await self.page.evaluate(f"window.scrollBy(0, -{amount})")
             elif direction == "bottom":
-                self.page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
+                await self.page.evaluate("window.scrollTo(0, document.body.scrollHeight)")
             elif direction == "top":
-                self.page.evaluate("window.scrollTo(0, 0)")
+                await self.page.evaluate("window.scrollTo(0, 0)")
             elif direction == "to":
-                self.page.evaluate(f"window.scrollTo(0, {amount})")
+                await self.page.evaluate(f"window.scrollTo(0, {amount})")
             
             return ActionResult(
                 success=True,
@@ -571,12 +2844,12 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="scroll", error=str(e))
     
-    def scroll_to_element(self, selector: str) -> ActionResult:
+    async def scroll_to_element(self, selector: str) -> ActionResult:
         """Hace scroll hasta un elemento."""
         try:
-            element = self.page.query_selector(selector)
+            element = await self.page.query_selector(selector)
             if element:
-                element.scroll_into_view_if_needed()
+                await element.scroll_into_view_if_needed()
                 return ActionResult(success=True, action="scroll_to_element")
             else:
                 return ActionResult(
@@ -587,16 +2860,16 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="scroll_to_element", error=str(e))
     
-    def select_option(self, selector: str, value: Optional[str] = None, 
+    async def select_option(self, selector: str, value: Optional[str] = None, 
                       label: Optional[str] = None, index: Optional[int] = None) -> ActionResult:
         """Selecciona una opción de un dropdown."""
         try:
             if value:
-                self.page.select_option(selector, value=value)
+                await self.page.select_option(selector, value=value)
             elif label:
-                self.page.select_option(selector, label=label)
+                await self.page.select_option(selector, label=label)
             elif index is not None:
-                self.page.select_option(selector, index=index)
+                await self.page.select_option(selector, index=index)
             else:
                 return ActionResult(
                     success=False,
@@ -608,10 +2881,10 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="select_option", error=str(e))
     
-    def get_attribute(self, selector: str, attribute: str) -> ActionResult:
+    async def get_attribute(self, selector: str, attribute: str) -> ActionResult:
         """Obtiene el valor de un atributo de un elemento."""
         try:
-            value = self.page.get_attribute(selector, attribute)
+            value = await self.page.get_attribute(selector, attribute)
             return ActionResult(
                 success=True,
                 action="get_attribute",
@@ -620,72 +2893,306 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="get_attribute", error=str(e))
     
-    def get_elements(self, selector: str) -> ActionResult:
-        """Obtiene información de todos los elementos que coinciden con el selector."""
+    async def get_elements(self, selector: str, fields: Optional[Any] = None,
+                           limit: Optional[int] = None, offset: int = 0,
+                           max_text: Optional[int] = 100) -> ActionResult:
+        """
+        Obtiene información de todos los elementos que coinciden con el selector.
+        
+        Todo se extrae con una sola evaluación en la página, sin idas y vueltas por
+        elemento. fields acepta text, tag, attributes, href, box, html, value y visible.
+        """
         try:
-            elements = self.page.query_selector_all(selector)
-            results = []
-            for i, element in enumerate(elements):
-                try:
-                    results.append({
-                        "index": i,
-                        "text": element.inner_text()[:100] if element.inner_text() else "",
-                        "tag": element.evaluate("el => el.tagName.toLowerCase()")
-                    })
-                except:
-                    results.append({"index": i, "error": "No se pudo extraer info"})
-            
+            if isinstance(fields, str):
+                fields = [f.strip() for f in fields.split(",") if f.strip()]
+            unknown = set(fields or []) - set(ELEMENT_FIELDS)
+            if unknown:
+                return ActionResult(
+                    success=False,
+                    action="get_elements",
+                    error=f"Campos desconocidos: {', '.join(sorted(unknown))}"
+                )
+            data = await self.page.eval_on_selector_all(selector, EXTRACT_ELEMENTS_JS, {
+                "fields": fields or ["text", "tag"],
+                "limit": limit,
+                "offset": offset or 0,
+                "maxText": max_text
+            })
             return ActionResult(
                 success=True,
                 action="get_elements",
-                data={"count": len(elements), "elements": results}
+                data=data
             )
         except Exception as e:
             return ActionResult(success=False, action="get_elements", error=str(e))
     
-    def go_back(self) -> ActionResult:
+    async def watch_dom(self, selector: Optional[str] = None, reset: bool = False,
+                        wait_ms: int = 0, max_text: int = 200, max_changes: int = 1000,
+                        html: bool = False) -> ActionResult:
+        """
+        Devuelve sólo los cambios del DOM desde la llamada anterior.
+        
+        La primera llamada (o tras navegar, o con reset) instala un MutationObserver
+        sobre selector (o todo el documento) y devuelve installed=True; las
+        siguientes devuelven los nodos añadidos/eliminados y los cambios de
+        atributos y texto acumulados. wait_ms espera hasta ese tiempo al primer
+        cambio si todavía no hay ninguno.
+        """
+        try:
+            data = await self.page.evaluate(WATCH_DOM_JS, {
+                "selector": selector,
+                "reset": reset,
+                "maxText": max_text,
+                "maxChanges": max_changes,
+                "html": html,
+                "waitMs": wait_ms or 0
+            })
+            return ActionResult(
+                success=True,
+                action="watch_dom",
+                data=data,
+                url=self.page.url
+            )
+        except Exception as e:
+            return ActionResult(success=False, action="watch_dom", error=str(e))
+    
+    async def extract(self, schema: Dict[str, Any], next_selector: Optional[str] = None,
+                      max_pages: int = 1, output: Optional[str] = None,
+                      timeout: int = 5000) -> ActionResult:
+        """
+        Extrae registros estructurados según un schema.
+        
+        schema = {"row": selector de fila, "fields": {campo: selector | {selector,
+        attribute, all}}}. Cada página se extrae con una sola evaluación; con
+        next_selector se sigue la paginación hasta max_pages. Con output los
+        registros se escriben como JSONL página a página en vez de acumularse.
+        """
+        try:
+            if isinstance(schema, str):
+                schema = json.loads(schema)
+            row_selector = (schema or {}).get("row")
+            if not row_selector or not schema.get("fields"):
+                return ActionResult(
+                    success=False,
+                    action="extract",
+                    error="El schema necesita 'row' y 'fields'"
+                )
+            fields = {
+                name: {"selector": spec} if isinstance(spec, str) else spec
+                for name, spec in schema["fields"].items()
+            }
+            
+            records: List[Dict[str, Any]] = []
+            total = 0
+            pages = 0
+            out = open(output, 'a', encoding='utf-8') if output else None
+            try:
+                while True:
+                    page_records = await self.page.eval_on_selector_all(row_selector, EXTRACT_RECORDS_JS, fields)
+                    pages += 1
+                    total += len(page_records)
+                    if out:
+                        for record in page_records:
+                            out.write(json.dumps(dict(record, _page=pages), ensure_ascii=False) + "\n")
+                        out.flush()
+                    else:
+                        records.extend(page_records)
+                    
+                    if not next_selector or pages >= max_pages:
+                        break
+                    if not await self._next_page(row_selector, next_selector, timeout):
+                        break
+            finally:
+                if out:
+                    out.close()
+            
+            data = {"count": total, "pages": pages}
+            if out:
+                data["output"] = os.path.abspath(output)
+            else:
+                data["records"] = records
+            return ActionResult(
+                success=True,
+                action="extract",
+                data=data,
+                url=self.page.url
+            )
+        except Exception as e:
+            return ActionResult(success=False, action="extract", error=str(e))
+    
+    async def harvest(self, selector: Optional[str] = None, schema: Optional[Dict[str, Any]] = None,
+                      key: Optional[Any] = None, max_items: Optional[int] = None,
+                      idle_scrolls: int = 3, time_budget: int = 30000, growth_timeout: int = 3000,
+                      output: Optional[str] = None, reset: bool = False) -> ActionResult:
+        """
+        Recoge los items de un feed con scroll infinito hasta una condición de parada.
+        
+        Los items son selector (o schema["row"], con schema["fields"] como en
+        extract). Cada ronda es una sola evaluación: extrae los items cuya clave
+        (key: selector, "@atributo" o {selector, attribute}; por defecto el texto)
+        no se ha visto, hace scroll y espera a que el feed crezca en vez de dormir.
+        Para con max_items, tras idle_scrolls rondas sin items nuevos o al agotar
+        time_budget ms. Las claves vistas quedan en la página: otra llamada
+        devuelve sólo lo nuevo (reset=True empieza de cero). Con output los items
+        se escriben como JSONL ronda a ronda en vez de acumularse.
+        """
+        try:
+            if isinstance(schema, str):
+                schema = json.loads(schema)
+            selector = (schema or {}).get("row") or selector
+            if not selector:
+                return ActionResult(success=False, action="harvest",
+                                    error="Debe especificar selector o un schema con 'row'")
+            fields = {
+                name: {"selector": spec} if isinstance(spec, str) else spec
+                for name, spec in ((schema or {}).get("fields") or {"text": {}}).items()
+            }
+            if isinstance(key, str):
+                key = {"attribute": key[1:]} if key.startswith("@") else {"selector": key}
+            
+            items: List[Dict[str, Any]] = []
+            total = rounds = idle = 0
+            stop = None
+            deadline = time.monotonic() + time_budget / 1000
+            out = open(output, 'a', encoding='utf-8') if output else None
+            try:
+                while stop is None:
+                    remaining_ms = int((deadline - time.monotonic()) * 1000)
+                    data = await self.page.evaluate(HARVEST_JS, {
+                        "selector": selector,
+                        "fields": fields,
+                        "key": key,
+                        "reset": reset and rounds == 0,
+                        "maxNew": max_items - total if max_items else None,
+                        "growthMs": max(0, min(growth_timeout, remaining_ms))
+                    })
+                    rounds += 1
+                    new_items = data["items"]
+                    total += len(new_items)
+                    if out:
+                        for item in new_items:
+                            out.write(json.dumps(dict(item, _round=rounds), ensure_ascii=False) + "\n")
+                        out.flush()
+                    else:
+                        items.extend(new_items)
+                    
+                    idle = 0 if new_items else idle + 1
+                    if max_items and total >= max_items:
+                        stop = "max_items"
+                    elif idle >= idle_scrolls:
+                        stop = "no_new_items"
+                    elif time.monotonic() >= deadline:
+                        stop = "time_budget"
+            finally:
+                if out:
+                    out.close()
+            
+            result = {"count": total, "rounds": rounds, "stop": stop, "seen": data["seen"]}
+            if out:
+                result["output"] = os.path.abspath(output)
+            else:
+                result["items"] = items
+            return ActionResult(
+                success=True,
+                action="harvest",
+                data=result,
+                url=self.page.url
+            )
+        except Exception as e:
+            return ActionResult(success=False, action="harvest", error=str(e))
+    
+    async def performance_metrics(self, waterfall: Optional[str] = None, top: int = 5) -> ActionResult:
+        """
+        Resumen de rendimiento de la página actual.
+        
+        Tiempos de navegación (DNS, conexión, TTFB, DOMContentLoaded, load), paint
+        (FP, FCP y, en Chromium, LCP y CLS), requests y bytes transferidos por tipo
+        de recurso y los top recursos más lentos. Con waterfall se escriben todas
+        las entradas de Navigation/Resource Timing en ese archivo JSON.
+        """
+        try:
+            data = await self.page.evaluate(PERFORMANCE_JS, {"top": top, "entries": bool(waterfall)})
+            if waterfall:
+                os.makedirs(os.path.dirname(os.path.abspath(waterfall)), exist_ok=True)
+                with open(waterfall, 'w', encoding='utf-8') as f:
+                    json.dump(dict(data.pop("entries"), url=self.page.url, captured_at=datetime.now().isoformat()),
+                              f, indent=2, ensure_ascii=False)
+                data["waterfall"] = os.path.abspath(waterfall)
+            return ActionResult(
+                success=True,
+                action="performance_metrics",
+                data=data,
+                url=self.page.url,
+                title=await self.page.title()
+            )
+        except Exception as e:
+            return ActionResult(success=False, action="performance_metrics", error=str(e))
+    
+    async def _next_page(self, row_selector: str, next_selector: str, timeout: int) -> bool:
+        """Pulsa "siguiente" y espera a que cambien las filas. False si no hay más páginas."""
+        next_button = await self.page.query_selector(next_selector)
+        if not next_button or not await next_button.is_enabled():
+            return False
+        
+        fingerprint_js = """(selector) => {
+            const rows = document.querySelectorAll(selector);
+            return location.href + '|' + rows.length + '|' + (rows[0] ? rows[0].outerHTML : '');
+        }"""
+        before = await self.page.evaluate(fingerprint_js, row_selector)
+        await next_button.click(timeout=timeout)
+        try:
+            await self.page.wait_for_function(
+                f"(args) => ({fingerprint_js})(args.selector) !== args.before",
+                arg={"selector": row_selector, "before": before},
+                timeout=timeout
+            )
+        except Exception:
+            return False
+        return True
+    
+    async def go_back(self) -> ActionResult:
         """Navega hacia atrás."""
         try:
-            self.page.go_back()
+            await self.page.go_back()
             return ActionResult(
                 success=True,
                 action="go_back",
                 url=self.page.url,
-                title=self.page.title()
+                title=await self.page.title()
             )
         except Exception as e:
             return ActionResult(success=False, action="go_back", error=str(e))
     
-    def go_forward(self) -> ActionResult:
+    async def go_forward(self) -> ActionResult:
         """Navega hacia adelante."""
         try:
-            self.page.go_forward()
+            await self.page.go_forward()
             return ActionResult(
                 success=True,
                 action="go_forward",
                 url=self.page.url,
-                title=self.page.title()
+                title=await self.page.title()
             )
         except Exception as e:
             return ActionResult(success=False, action="go_forward", error=str(e))
     
-    def reload(self) -> ActionResult:
+    async def reload(self) -> ActionResult:
         """Recarga la página."""
         try:
-            self.page.reload()
+            await self.page.reload()
             return ActionResult(
                 success=True,
                 action="reload",
                 url=self.page.url,
-                title=self.page.title()
+                title=await self.page.title()
             )
         except Exception as e:
             return ActionResult(success=False, action="reload", error=str(e))
     
-    def set_viewport(self, width: int, height: int) -> ActionResult:
+    async def set_viewport(self, width: int, height: int) -> ActionResult:
         """Cambia el tamaño de la ventana."""
         try:
-            self.page.set_viewport_size({"width": width, "height": height})
+            await self.page.set_viewport_size({"width": width, "height": height})
             return ActionResult(
                 success=True,
                 action="set_viewport",
@@ -694,27 +3201,27 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="set_viewport", error=str(e))
     
-    def new_tab(self, url: Optional[str] = None) -> ActionResult:
+    async def new_tab(self, url: Optional[str] = None) -> ActionResult:
         """Abre una nueva pestaña."""
         try:
-            new_page = self.context.new_page()
+            new_page = await self.context.new_page()
             if url:
-                new_page.goto(url)
+                await new_page.goto(url)
             # Cambiar a la nueva página
             self.page = new_page
             return ActionResult(
                 success=True,
                 action="new_tab",
                 url=self.page.url,
-                title=self.page.title()
+                title=await self.page.title()
             )
         except Exception as e:
             return ActionResult(success=False, action="new_tab", error=str(e))
     
-    def close_tab(self) -> ActionResult:
+    async def close_tab(self) -> ActionResult:
         """Cierra la pestaña actual."""
         try:
-            self.page.close()
+            await self.page.close()
             # Volver a la primera página disponible
             pages = self.context.pages
             if pages:
@@ -727,7 +3234,7 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="close_tab", error=str(e))
     
-    def switch_tab(self, index: int = 0) -> ActionResult:
+    async def switch_tab(self, index: int = 0) -> ActionResult:
         """Cambia a otra pestaña por índice."""
         try:
             pages = self.context.pages
@@ -737,7 +3244,7 @@ class BrowserController:
                     success=True,
                     action="switch_tab",
                     url=self.page.url,
-                    title=self.page.title()
+                    title=await self.page.title()
                 )
             else:
                 return ActionResult(
@@ -748,7 +3255,7 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="switch_tab", error=str(e))
     
-    def list_tabs(self) -> ActionResult:
+    async def list_tabs(self) -> ActionResult:
         """Lista todas las pestañas abiertas."""
         try:
             pages = self.context.pages
@@ -757,27 +3264,27 @@ class BrowserController:
                 tabs.append({
                     "index": i,
                     "url": page.url,
-                    "title": page.title()
+                    "title": await page.title()
                 })
             return ActionResult(
                 success=True,
                 action="list_tabs",
-                data={"tabs": tabs, "count": len(tabs)}
+                data={"tabs": tabs, "count": len(tabs), "resources": self.resource_metrics()}
             )
         except Exception as e:
             return ActionResult(success=False, action="list_tabs", error=str(e))
     
-    def handle_dialog(self, accept: bool = True, prompt_text: Optional[str] = None) -> ActionResult:
+    async def handle_dialog(self, accept: bool = True, prompt_text: Optional[str] = None) -> ActionResult:
         """Configura el manejo de diálogos (alert, confirm, prompt)."""
         try:
-            def dialog_handler(dialog):
+            async def dialog_handler(dialog):
                 if accept:
                     if prompt_text and dialog.type == "prompt":
-                        dialog.accept(prompt_text)
+                        await dialog.accept(prompt_text)
                     else:
-                        dialog.accept()
+                        await dialog.accept()
                 else:
-                    dialog.dismiss()
+                    await dialog.dismiss()
             
             self.page.on("dialog", dialog_handler)
             return ActionResult(
@@ -788,42 +3295,545 @@ class BrowserController:
         except Exception as e:
             return ActionResult(success=False, action="handle_dialog", error=str(e))
     
-    def hover(self, selector: str) -> ActionResult:
+    async def hover(self, selector: str) -> ActionResult:
         """Hace hover sobre un elemento."""
         try:
-            self.page.hover(selector)
+            await self.page.hover(selector)
             return ActionResult(success=True, action="hover")
         except Exception as e:
             return ActionResult(success=False, action="hover", error=str(e))
     
-    def focus(self, selector: str) -> ActionResult:
+    async def focus(self, selector: str) -> ActionResult:
         """Enfoca un elemento."""
         try:
-            self.page.focus(selector)
+            await self.page.focus(selector)
             return ActionResult(success=True, action="focus")
         except Exception as e:
             return ActionResult(success=False, action="focus", error=str(e))
     
-    def clear(self, selector: str) -> ActionResult:
+    async def clear(self, selector: str) -> ActionResult:
         """Limpia un campo de texto."""
         try:
-            self.page.fill(selector, "")
+            await self.page.fill(selector, "")
             return ActionResult(success=True, action="clear")
         except Exception as e:
             return ActionResult(success=False, action="clear", error=str(e))
     
-    def check(self, selector: str, checked: bool = True) -> ActionResult:
+    async def check(self, selector: str, checked: bool = True) -> ActionResult:
         """Marca o desmarca un checkbox."""
         try:
             if checked:
-                self.page.check(selector)
+                await self.page.check(selector)
             else:
-                self.page.uncheck(selector)
+                await self.page.uncheck(selector)
             return ActionResult(success=True, action="check", data={"checked": checked})
         except Exception as e:
             return ActionResult(success=False, action="check", error=str(e))
 
 
+class BrowserController:
+    """
+    Controlador principal del navegador (API síncrona).
+    
+    Envoltorio fino sobre AsyncBrowserController: un event loop propio corre en un
+    hilo de fondo y cada método espera el resultado de la corrutina equivalente.
+    """
+    
+    def __init__(self, headless: bool = True, browser_type: str = "chromium",
+                 engine: Optional[AsyncBrowserController] = None, **engine_options):
+        self.engine = engine or AsyncBrowserController(headless=headless, browser_type=browser_type,
+                                                       **engine_options)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+    
+    def run(self, coro):
+        """Ejecuta una corrutina en el loop del motor y devuelve su resultado."""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._loop.run_forever, daemon=True,
+                                            name="browser-controller-loop")
+            self._thread.start()
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+    
+    def start(self) -> ActionResult:
+        """Inicia el navegador."""
+        return self.run(self.engine.start())
+    
+    def stop(self) -> ActionResult:
+        """Cierra el navegador y el loop de fondo."""
+        result = self.run(self.engine.stop())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+        self._loop.close()
+        self._loop = None
+        self._thread = None
+        return result
+    
+    def execute_action(self, action: str, params: Dict[str, Any]) -> ActionResult:
+        """Ejecuta una acción con parámetros dinámicos."""
+        return self.run(self.engine.execute_action(action, params))
+    
+    def __getattr__(self, name: str):
+        # Delegar el resto de la API en el motor, envolviendo las corrutinas
+        if name == "engine":
+            raise AttributeError(name)
+        attr = getattr(self.engine, name)
+        if asyncio.iscoroutinefunction(attr):
+            return lambda *args, **kwargs: self.run(attr(*args, **kwargs))
+        return attr
+
+
+def _parse_daemon_address(address: str):
+    """Convierte una dirección de daemon en (familia, sockaddr)."""
+    if hasattr(socket, "AF_UNIX") and (os.sep in address or "/" in address or ":" not in address):
+        return socket.AF_UNIX, address
+    host, _, port = address.rpartition(":")
+    return socket.AF_INET, (host or "127.0.0.1", int(port))
+
+
+def _daemon_token_path(port: int) -> str:
+    """Archivo (0600) con el token que exige un daemon TCP en ese puerto."""
+    return os.path.join(DAEMON_DIR, f"daemon-{port}.token")
+
+
+def _read_daemon_token(port: int) -> Optional[str]:
+    """Token del daemon TCP en ese puerto, o None si este usuario no puede leerlo."""
+    try:
+        with open(_daemon_token_path(port), 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _owned_by_user(path: str) -> bool:
+    """True si path pertenece al usuario actual (siempre en plataformas sin uid)."""
+    if not hasattr(os, "getuid"):
+        return True
+    try:
+        return os.stat(path).st_uid == os.getuid()
+    except OSError:
+        return False
+
+
+class DaemonClient:
+    """Cliente del daemon: envía peticiones JSON (una por línea) y lee la respuesta."""
+    
+    def __init__(self, address: str = DAEMON_ADDRESS, connect_timeout: float = 1.0):
+        self.address = address
+        self.connect_timeout = connect_timeout
+        self._sock: Optional[socket.socket] = None
+        self._file = None
+        self._token: Optional[str] = None
+    
+    def connect(self) -> bool:
+        """Conecta con el daemon. Devuelve False si no hay daemon escuchando."""
+        try:
+            family, sockaddr = _parse_daemon_address(self.address)
+            # Un socket de otro usuario recibiría textos de fill, perfiles de sesión...
+            if family != socket.AF_INET and not _owned_by_user(sockaddr):
+                return False
+            sock = socket.socket(family, socket.SOCK_STREAM)
+            sock.settimeout(self.connect_timeout)
+            sock.connect(sockaddr)
+            # Las acciones pueden tardar (esperas, sleeps): sin timeout de lectura
+            sock.settimeout(None)
+        except (OSError, ValueError):
+            return False
+        self._sock = sock
+        self._file = sock.makefile("rb")
+        if family == socket.AF_INET:
+            self._token = _read_daemon_token(sockaddr[1])
+        return True
+    
+    def request(self, payload: Dict[str, Any],
+                on_event: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+        """
+        Envía una petición y devuelve la respuesta decodificada.
+        
+        Las líneas intermedias con "event" (pasos de un run_recipe con stream) se
+        entregan a on_event antes de la respuesta final.
+        """
+        if self._token:
+            payload = dict(payload, token=self._token)
+        self._sock.sendall(json.dumps(payload).encode("utf-8") + b"\n")
+        while True:
+            line = self._file.readline()
+            if not line:
+                raise ConnectionError("El daemon cerró la conexión")
+            message = json.loads(line)
+            if "event" not in message:
+                return message
+            if on_event:
+                on_event(message)
+    
+    def close(self):
+        """Cierra la conexión."""
+        if self._file:
+            self._file.close()
+        if self._sock:
+            self._sock.close()
+        self._sock = None
+        self._file = None
+    
+    def __enter__(self) -> 'DaemonClient':
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _connect_daemon(address: str) -> Optional[DaemonClient]:
+    """Devuelve un cliente conectado si hay un daemon activo, o None."""
+    client = DaemonClient(address)
+    return client if client.connect() else None
+
+
+class BrowserDaemon:
+    """
+    Daemon que mantiene navegadores vivos entre llamadas del CLI.
+    
+    Cada sesión con nombre tiene su propio BrowserController ya iniciado, de modo
+    que las acciones se ejecutan sobre la página viva sin relanzar el navegador.
+    Protocolo: una petición JSON por línea, una respuesta JSON por línea. En TCP
+    cada petición debe llevar el token que el daemon escribe en DAEMON_DIR.
+    """
+    
+    def __init__(self, address: str = DAEMON_ADDRESS, headless: bool = True,
+                 browser_type: str = "chromium", idle_timeout: Optional[float] = None,
+                 **engine_options):
+        self.address = address
+        self.headless = headless
+        self.browser_type = browser_type
+        self.idle_timeout = idle_timeout
+        self.engine_options = engine_options
+        self.sessions: Dict[str, BrowserController] = {}
+        self._selector = selectors.DefaultSelector()
+        self._running = False
+        self._last_activity = time.monotonic()
+        self._token: Optional[str] = None
+    
+    def _write_token(self, port: int) -> str:
+        """Genera el token del daemon TCP y lo deja legible sólo por el usuario actual."""
+        os.makedirs(DAEMON_DIR, mode=0o700, exist_ok=True)
+        path = _daemon_token_path(port)
+        if os.path.exists(path):
+            os.unlink(path)
+        token = os.urandom(32).hex()
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(token)
+        return token
+    
+    def open_session(self, name: str, headless: Optional[bool] = None,
+                     browser_type: Optional[str] = None,
+                     engine_options: Optional[Dict[str, Any]] = None) -> ActionResult:
+        """Obtiene una sesión existente o inicia un navegador nuevo para ella."""
+        if name in self.sessions:
+            return ActionResult(success=True, action="start", data={"session": name, "reused": True})
+        
+        options = dict(self.engine_options)
+        options.update({k: v for k, v in (engine_options or {}).items() if v})
+        try:
+            controller = BrowserController(
+                headless=self.headless if headless is None else headless,
+                browser_type=browser_type or self.browser_type,
+                **options
+            )
+        except ValueError as e:
+            return ActionResult(success=False, action="start", error=str(e))
+        result = controller.start()
+        if result.success:
+            self.sessions[name] = controller
+            result.data = dict(result.data or {}, session=name, reused=False)
+        return result
+    
+    def close_session(self, name: str) -> ActionResult:
+        """Cierra el navegador de una sesión."""
+        controller = self.sessions.pop(name, None)
+        if controller is None:
+            return ActionResult(success=False, action="stop", error=f"Sesión no encontrada: {name}")
+        result = controller.stop()
+        result.data = {"session": name}
+        return result
+    
+    def _recycle_sessions(self):
+        """Aplica los umbrales de reciclado de las sesiones abiertas mientras no hay peticiones."""
+        for controller in self.sessions.values():
+            controller.maybe_recycle()
+    
+    def list_sessions(self) -> ActionResult:
+        """Lista las sesiones abiertas con su página actual."""
+        sessions = []
+        for name, controller in self.sessions.items():
+            try:
+                sessions.append({"session": name, "browser": controller.browser_type,
+                                 "url": controller.page.url, "tabs": len(controller.context.pages),
+                                 "resources": controller.resource_metrics()})
+            except Exception as e:
+                sessions.append({"session": name, "browser": controller.browser_type, "error": str(e)})
+        return ActionResult(
+            success=True,
+            action="sessions",
+            data={"pid": os.getpid(), "count": len(sessions), "sessions": sessions}
+        )
+    
+    def handle_request(self, request: Dict[str, Any],
+                       emit: Optional[Callable[[Dict[str, Any]], None]] = None) -> ActionResult:
+        """Despacha una petición del cliente (emit envía eventos intermedios a la conexión)."""
+        command = request.get("command", "action")
+        session = request.get("session") or "default"
+        
+        if command == "ping":
+            return ActionResult(success=True, action="ping",
+                                data={"pid": os.getpid(), "sessions": list(self.sessions)})
+        if command == "sessions":
+            return self.list_sessions()
+        if command == "close_session":
+            return self.close_session(session)
+        if command == "shutdown":
+            self._running = False
+            return ActionResult(success=True, action="shutdown", data={"sessions": list(self.sessions)})
+        
+        if command not in ("action", "run_recipe"):
+            return ActionResult(success=False, action=str(command), error=f"Comando desconocido: {command}")
+        
+        action = request.get("action")
+        if command == "action" and action == "stop":
+            return self.close_session(session)
+        
+        start_result = self.open_session(session, request.get("headless"), request.get("browser"),
+                                         request.get("options"))
+        if not start_result.success or (command == "action" and action == "start"):
+            return start_result
+        
+        controller = self.sessions[session]
+        if action != "recycle":
+            controller.maybe_recycle()
+        if command == "run_recipe":
+            return RecipeManager.run_recipe(
+                name=request.get("name"),
+                variable_values=request.get("variables") or {},
+                controller=controller,
+                trace=request.get("trace"),
+                session=request.get("session_profile"),
+                checkpoint=bool(request.get("checkpoint")),
+                resume=bool(request.get("resume")),
+                on_step=(lambda entry: emit(dict(entry, event="step"))) if emit and request.get("stream") else None,
+                max_payload=request.get("max_payload"),
+                spill_dir=request.get("spill_dir")
+            )
+        return controller.execute_action(action, request.get("params") or {})
+    
+    def serve_forever(self) -> ActionResult:
+        """Escucha peticiones hasta recibir shutdown o agotar el idle timeout."""
+        family, sockaddr = _parse_daemon_address(self.address)
+        if family == getattr(socket, "AF_UNIX", None):
+            if os.path.lexists(sockaddr):
+                if not _owned_by_user(sockaddr):
+                    return ActionResult(success=False, action="daemon",
+                                        error=f"{sockaddr} pertenece a otro usuario")
+                with DaemonClient(self.address) as probe:
+                    if probe.connect():
+                        return ActionResult(success=False, action="daemon",
+                                            error=f"Ya hay un daemon escuchando en {self.address}")
+                os.unlink(sockaddr)
+            os.makedirs(os.path.dirname(os.path.abspath(sockaddr)), mode=0o700, exist_ok=True)
+        
+        server = socket.socket(family, socket.SOCK_STREAM)
+        if family == socket.AF_INET:
+            server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            server.bind(sockaddr)
+            sockaddr = server.getsockname()
+            self._token = self._write_token(sockaddr[1])
+        else:
+            # Socket accesible sólo por el usuario actual
+            old_umask = os.umask(0o177)
+            try:
+                server.bind(sockaddr)
+            finally:
+                os.umask(old_umask)
+        server.listen(64)
+        server.setblocking(False)
+        self._selector.register(server, selectors.EVENT_READ, data=None)
+        self._running = True
+        
+        try:
+            while self._running:
+                for key, _ in self._selector.select(timeout=1.0):
+                    if key.data is None:
+                        conn, _ = key.fileobj.accept()
+                        conn.setblocking(False)
+                        self._selector.register(conn, selectors.EVENT_READ, data=bytearray())
+                    else:
+                        self._service(key)
+                if self.idle_timeout and time.monotonic() - self._last_activity > self.idle_timeout:
+                    break
+                self._recycle_sessions()
+        finally:
+            for key in list(self._selector.get_map().values()):
+                self._selector.unregister(key.fileobj)
+                key.fileobj.close()
+            self._selector.close()
+            for name in list(self.sessions):
+                self.close_session(name)
+            if family != socket.AF_INET and os.path.exists(sockaddr):
+                os.unlink(sockaddr)
+            if self._token and _read_daemon_token(sockaddr[1]) == self._token:
+                os.unlink(_daemon_token_path(sockaddr[1]))
+        
+        return ActionResult(success=True, action="daemon", data={"address": self.address})
+    
+    def _service(self, key):
+        """Lee datos de una conexión y responde cada línea completa."""
+        conn, buffer = key.fileobj, key.data
+        try:
+            chunk = conn.recv(65536)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            chunk = b""
+        if not chunk:
+            self._selector.unregister(conn)
+            conn.close()
+            return
+        
+        buffer.extend(chunk)
+        while b"\n" in buffer:
+            line, _, rest = bytes(buffer).partition(b"\n")
+            buffer[:] = rest
+            if not line.strip():
+                continue
+            self._last_activity = time.monotonic()
+            
+            def emit(event, conn=conn):
+                conn.setblocking(True)
+                try:
+                    conn.sendall(json.dumps(event).encode("utf-8") + b"\n")
+                finally:
+                    conn.setblocking(False)
+            
+            try:
+                request = json.loads(line)
+                if self._token and not hmac.compare_digest(str(request.get("token") or ""), self._token):
+                    result = ActionResult(success=False, action="daemon",
+                                          error="Token del daemon ausente o inválido")
+                else:
+                    result = self.handle_request(request, emit)
+            except json.JSONDecodeError as e:
+                result = ActionResult(success=False, action="daemon", error=f"Petición inválida: {e}")
+            except Exception as e:
+                result = ActionResult(success=False, action="daemon", error=str(e))
+            
+            payload = json.dumps(result.to_dict()).encode("utf-8") + b"\n"
+            try:
+                conn.setblocking(True)
+                conn.sendall(payload)
+                conn.setblocking(False)
+            except OSError:
+                self._selector.unregister(conn)
+                conn.close()
+                return
+
+
+def _load_json_arg(value: Optional[str]) -> Any:
+    """Interpreta un argumento como ruta a un archivo JSON o como JSON literal."""
+    if value is None:
+        return None
+    if os.path.isfile(value):
+        with open(value, 'r', encoding='utf-8-sig') as f:
+            return json.load(f)
+    return json.loads(value)
+
+
+# Parámetros de acción que son rutas de archivo o directorio de salida
+PATH_PARAMS = ("path", "dir", "output", "waterfall")
+
+
+def _absolute_paths(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Resuelve las rutas relativas de params contra el cwd del cliente (el daemon tiene
+    otro). dir "shm" no es una ruta: lo resuelve _screenshot_dir en el daemon.
+    """
+    return {k: os.path.abspath(v) if k in PATH_PARAMS and isinstance(v, str)
+            and not (k == "dir" and v == "shm") else v
+            for k, v in params.items()}
+
+
+def run_stream(lines, out, headless: bool = True, browser_type: str = "chromium",
+               daemon_client: Optional[DaemonClient] = None, session: str = "default",
+               **engine_options) -> bool:
+    """
+    Ejecuta acciones JSONL de lines sobre una sola sesión de navegador.
+    
+    Cada línea es {"action": ..., "params": {...}} o {"command": "run_recipe", "name":
+    ..., "variables": {...}}; "id" opcional se devuelve en la respuesta. Se escribe una
+    línea JSON por petición en cuanto termina. Con daemon_client las peticiones van
+    al daemon por la misma conexión; si no, se usa un navegador propio que se cierra
+    al acabar la entrada. Si el daemon se cae a mitad, esa petición falla y las
+    siguientes pasan al navegador propio. Devuelve True si todas tuvieron éxito.
+    """
+    controller = None
+    all_success = True
+    try:
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("cada línea debe ser un objeto JSON")
+            except ValueError as e:
+                response = ActionResult(success=False, action="stream", error=f"JSON inválido: {e}").to_dict()
+                request = {}
+            else:
+                if daemon_client:
+                    payload = {"session": session, "headless": headless, "browser": browser_type,
+                               "options": engine_options}
+                    payload.update(request)
+                    payload.pop("id", None)
+                    if isinstance(payload.get("params"), dict):
+                        payload["params"] = _absolute_paths(payload["params"])
+                    try:
+                        response = daemon_client.request(payload)
+                    except (OSError, ValueError) as e:
+                        # Daemon parado (idle timeout, --daemon-stop): la petición pudo quedar a
+                        # medias, así que no se repite; las siguientes van a un navegador local
+                        response = ActionResult(success=False, action=str(request.get("action") or "stream"),
+                                                error=f"Conexión con el daemon perdida: {e}").to_dict()
+                        daemon_client.close()
+                        daemon_client = None
+                else:
+                    if controller is None:
+                        controller = BrowserController(headless=headless, browser_type=browser_type,
+                                                       **engine_options)
+                        start_result = controller.start()
+                        if not start_result.success:
+                            controller = None
+                            response = start_result.to_dict()
+                    if controller is not None:
+                        if request.get("action") != "recycle":
+                            controller.maybe_recycle()
+                        if request.get("command") == "run_recipe":
+                            result = RecipeManager.run_recipe(
+                                name=request.get("name"),
+                                variable_values=request.get("variables") or {},
+                                controller=controller
+                            )
+                        else:
+                            result = controller.execute_action(request.get("action"), request.get("params") or {})
+                        response = result.to_dict()
+            
+            if "id" in request:
+                response["id"] = request["id"]
+            all_success = all_success and bool(response.get("success"))
+            out.write(json.dumps(response, ensure_ascii=False) + "\n")
+            out.flush()
+    finally:
+        if controller is not None:
+            controller.stop()
+    return all_success
+
+
 def main():
     parser = argparse.ArgumentParser(description="Browser Controller")
     
@@ -832,7 +3842,7 @@ def main():
     parser.add_argument("--url", help="URL para navegar")
     parser.add_argument("--selector", "-s", help="Selector CSS del elemento")
     parser.add_argument("--text", "-t", help="Texto para escribir")
-    parser.add_argument("--key", help="Tecla a presionar")
+    parser.add_argument("--key", help="Tecla a presionar (harvest: clave de dedupe, selector o @atributo)")
     parser.add_argument("--attribute", help="Atributo a obtener")
     parser.add_argument("--value", help="Valor para select/checkbox")
     parser.add_argument("--label", help="Label para select")
@@ -842,10 +3852,42 @@ def main():
     parser.add_argument("--width", type=int, help="Ancho de viewport")
     parser.add_argument("--height", type=int, help="Alto de viewport")
     parser.add_argument("--timeout", type=int, default=5000, help="Timeout en ms")
+    parser.add_argument("--wait-until", help="Estrategia de carga de navigate: auto, domcontentloaded, load, networkidle")
+    parser.add_argument("--ready-selector", help="auto: listo cuando aparece este selector")
+    parser.add_argument("--ready-js", help="auto: listo cuando esta expresión JS es verdadera")
+    parser.add_argument("--dom-idle", type=int, help="auto: listo cuando el DOM no muta durante N ms")
     parser.add_argument("--delay", type=int, default=50, help="Delay entre teclas")
     parser.add_argument("--full-page", action="store_true", help="Screenshot de página completa")
+    parser.add_argument("--output", "-o", help="Archivo de salida (screenshot)")
+    parser.add_argument("--output-dir", help="Directorio de salida para screenshots ('shm' = memoria compartida)")
+    parser.add_argument("--format", choices=["png", "jpeg", "webp"], help="Formato de screenshot")
+    parser.add_argument("--quality", type=int, help="Calidad 0-100 para jpeg/webp")
+    parser.add_argument("--clip", help="Región del screenshot: x,y,ancho,alto")
+    parser.add_argument("--fields", help="Campos de get_elements separados por coma (text,tag,attributes,href,box,html,value,visible)")
+    parser.add_argument("--limit", type=int, help="Máximo de elementos a devolver")
+    parser.add_argument("--offset", type=int, help="Elementos a saltar antes de devolver")
+    parser.add_argument("--idle-scrolls", type=int, help="harvest: parar tras N scrolls sin items nuevos")
+    parser.add_argument("--time-budget", type=int, help="harvest: tiempo máximo en ms")
+    parser.add_argument("--schema", help="Schema de extract en JSON (o ruta a un archivo JSON)")
+    parser.add_argument("--next", help="Selector del botón 'siguiente página' para extract")
+    parser.add_argument("--max-pages", type=int, help="Máximo de páginas a recorrer con extract")
+    parser.add_argument("--reset", action="store_true", help="watch_dom: reinstalar el observer y descartar cambios")
+    parser.add_argument("--wait-ms", type=int, help="watch_dom: esperar hasta N ms al primer cambio")
     parser.add_argument("--headless", action="store_true", default=True, help="Modo headless")
     parser.add_argument("--browser", default="chromium", choices=["chromium", "firefox", "webkit"])
+    parser.add_argument("--block", action="append", choices=list(BLOCK_PROFILES), default=[],
+                        help="Perfil de bloqueo de red (repetible)")
+    parser.add_argument("--block-url", action="append", default=[],
+                        help="Patrón glob de URLs a bloquear (repetible)")
+    parser.add_argument("--har", help="Archivo HAR (.har o .zip) para grabar o reproducir el tráfico")
+    parser.add_argument("--har-mode", choices=["auto", "record", "replay"],
+                        help="auto (por defecto): reproduce si el HAR existe, si no graba")
+    parser.add_argument("--har-not-found", choices=["abort", "fallback"],
+                        help="replay: qué hacer con requests que no están en el HAR (por defecto abort)")
+    parser.add_argument("--recycle-actions", type=int, help="Reciclar el contexto cada N acciones")
+    parser.add_argument("--recycle-rss", type=float, help="Reciclar el contexto si el navegador supera N MB de RSS")
+    parser.add_argument("--recycle-idle", type=float, help="Reciclar el contexto tras N segundos sin acciones")
+    parser.add_argument("--max-tabs", type=int, help="Cerrar las pestañas más antiguas por encima de N")
     parser.add_argument("--download-path", help="Ruta para descargar archivos")
     parser.add_argument("--prompt-text", help="Texto para prompt dialogs")
     parser.add_argument("--accept", type=lambda x: x.lower() == 'true', default=True, help="Aceptar/dismiss dialog")
@@ -862,15 +3904,94 @@ def main():
     parser.add_argument("--show-recipe", help="Mostrar contenido de un recipe")
     parser.add_argument("--delete-recipe", help="Eliminar un recipe")
     parser.add_argument("--list-recipes", action="store_true", help="Listar todos los recipes")
+    parser.add_argument("--prefix", help="Filtrar --list-recipes por prefijo del nombre")
     parser.add_argument("--var", action="append", help="Valores de variables (formato: nombre=valor)", default=[])
+    parser.add_argument("--batch", help="Archivo JSONL/CSV con conjuntos de variables para --run-recipe")
+    parser.add_argument("--concurrency", type=int, default=4, help="Workers en paralelo para --batch (por proceso con --processes)")
+    parser.add_argument("--processes", type=int, help="Repartir --batch entre N procesos, cada uno con su navegador")
+    parser.add_argument("--browsers", help="Navegadores por proceso, asignados por turnos (ej: chromium,firefox)")
+    parser.add_argument("--jsonl", action="store_true",
+                        help="Emitir cada paso de --run-recipe como una línea JSON en cuanto termina")
+    parser.add_argument("--max-payload", type=int, help="Truncar valores de más de N bytes en los resultados (con sha256)")
+    parser.add_argument("--spill-dir", help="Volcar a este directorio los valores grandes en vez de truncarlos")
+    parser.add_argument("--checkpoint", action="store_true", help="Guardar un checkpoint tras cada paso de --run-recipe")
+    parser.add_argument("--resume", action="store_true", help="Retomar --run-recipe desde el último checkpoint")
+    parser.add_argument("--session-profile", help="Perfil de sesión para load_session/save_session o para --run-recipe")
+    parser.add_argument("--session-ttl", type=float, help="Segundos de validez al guardar un perfil de sesión")
+    parser.add_argument("--list-sessions", action="store_true", help="Listar perfiles de sesión guardados")
+    parser.add_argument("--delete-session", help="Eliminar un perfil de sesión")
+    parser.add_argument("--trace", help="Exportar la ejecución de --run-recipe (.zip = trace de Playwright, .json = trace events de Chrome)")
+    
+    # Daemon persistente
+    parser.add_argument("--daemon", action="store_true", help="Iniciar daemon que mantiene el navegador vivo")
+    parser.add_argument("--daemon-stop", action="store_true", help="Detener el daemon")
+    parser.add_argument("--daemon-status", action="store_true", help="Mostrar sesiones del daemon")
+    parser.add_argument("--daemon-address", default=DAEMON_ADDRESS, help="Socket Unix o host:puerto del daemon")
+    parser.add_argument("--daemon-idle-timeout", type=float, help="Cerrar el daemon tras N segundos sin peticiones")
+    parser.add_argument("--session", default="default", help="Sesión del daemon a usar")
+    parser.add_argument("--stream", action="store_true",
+                        help="Leer acciones JSONL de stdin y escribir un resultado JSON por línea")
+    parser.add_argument("--no-daemon", action="store_true", help="No usar el daemon aunque esté activo")
     
     args = parser.parse_args()
     
+    # Opciones del motor compartidas por acciones, recipes, lotes y daemon
+    engine_options = {
+        "block": args.block,
+        "block_urls": args.block_url,
+        "har": os.path.abspath(args.har) if args.har else None,
+        "har_mode": args.har_mode,
+        "har_not_found": args.har_not_found,
+        "recycle_actions": args.recycle_actions,
+        "recycle_rss_mb": args.recycle_rss,
+        "recycle_idle_s": args.recycle_idle,
+        "max_tabs": args.max_tabs
+    }
+    
+    # ===== DAEMON =====
+    
+    if args.daemon:
+        daemon = BrowserDaemon(
+            address=args.daemon_address,
+            headless=args.headless,
+            browser_type=args.browser,
+            idle_timeout=args.daemon_idle_timeout,
+            **engine_options
+        )
+        result = daemon.serve_forever()
+        print(json.dumps(result.to_dict(), indent=2))
+        sys.exit(0 if result.success else 1)
+    
+    if args.daemon_stop or args.daemon_status:
+        command = "shutdown" if args.daemon_stop else "sessions"
+        with DaemonClient(args.daemon_address) as client:
+            if not client.connect():
+                result = ActionResult(success=False, action=command,
+                                      error=f"No hay daemon escuchando en {args.daemon_address}")
+                print(json.dumps(result.to_dict(), indent=2))
+                sys.exit(1)
+            response = client.request({"command": command})
+        print(json.dumps(response, indent=2))
+        sys.exit(0 if response.get("success") else 1)
+    
+    
+    # ===== MODO STREAM =====
+    
+    if args.stream:
+        daemon_client = None if args.no_daemon else _connect_daemon(args.daemon_address)
+        try:
+            ok = run_stream(sys.stdin, sys.stdout, headless=args.headless, browser_type=args.browser,
+                            daemon_client=daemon_client, session=args.session, **engine_options)
+        finally:
+            if daemon_client:
+                daemon_client.close()
+        sys.exit(0 if ok else 1)
+    
     # ===== GESTIÓN DE RECIPES =====
     
     # Listar recipes
     if args.list_recipes:
-        result = RecipeManager.list_recipes()
+        result = RecipeManager.list_recipes(prefix=args.prefix)
         print(json.dumps(result.to_dict(), indent=2))
         sys.exit(0 if result.success else 1)
     
@@ -886,6 +4007,17 @@ def main():
         print(json.dumps(result.to_dict(), indent=2))
         sys.exit(0 if result.success else 1)
     
+    # Perfiles de sesión
+    if args.list_sessions:
+        result = SessionStore.list_sessions()
+        print(json.dumps(result.to_dict(), indent=2))
+        sys.exit(0 if result.success else 1)
+    
+    if args.delete_session:
+        result = SessionStore.delete(args.delete_session)
+        print(json.dumps(result.to_dict(), indent=2))
+        sys.exit(0 if result.success else 1)
+    
     # Crear recipe
     if args.create_recipe:
         # Cargar pasos desde archivo o argumento
@@ -924,13 +4056,79 @@ def main():
                 name, value = var.split('=', 1)
                 variable_values[name] = value
         
+        # Ejecución por lotes: un resultado JSONL por item a medida que termina
+        if args.batch:
+            variable_sets = [dict(variable_values, **item)
+                             for item in RecipeManager.load_variable_sets(args.batch)]
+            
+            def emit(item):
+                print(json.dumps(item, ensure_ascii=False), flush=True)
+            
+            if args.processes or args.browsers:
+                result = RecipeManager.run_sharded(
+                    name=args.run_recipe,
+                    variable_sets=variable_sets,
+                    processes=args.processes,
+                    concurrency=args.concurrency,
+                    browsers=args.browsers.split(",") if args.browsers else [args.browser],
+                    headless=args.headless,
+                    on_result=emit,
+                    **engine_options
+                )
+            else:
+                result = RecipeManager.run_batch(
+                    name=args.run_recipe,
+                    variable_sets=variable_sets,
+                    concurrency=args.concurrency,
+                    headless=args.headless,
+                    browser_type=args.browser,
+                    on_result=emit,
+                    **engine_options
+                )
+            print(json.dumps(result.to_dict(), ensure_ascii=False), flush=True)
+            sys.exit(0 if result.success else 1)
+        
+        def emit_step(entry):
+            print(json.dumps(entry, ensure_ascii=False), flush=True)
+        
+        # Usar el daemon si está activo (uso transparente)
+        daemon_client = None if args.no_daemon else _connect_daemon(args.daemon_address)
+        if daemon_client:
+            response = daemon_client.request({
+                "command": "run_recipe",
+                "session": args.session,
+                "name": args.run_recipe,
+                "variables": variable_values,
+                "headless": args.headless,
+                "browser": args.browser,
+                "options": engine_options,
+                "trace": os.path.abspath(args.trace) if args.trace else None,
+                "session_profile": args.session_profile,
+                "checkpoint": args.checkpoint,
+                "resume": args.resume,
+                "stream": args.jsonl,
+                "max_payload": args.max_payload,
+                "spill_dir": os.path.abspath(args.spill_dir) if args.spill_dir else None
+            }, on_event=emit_step)
+            daemon_client.close()
+            print(json.dumps(response, indent=None if args.jsonl else 2))
+            sys.exit(0 if response.get("success") else 1)
+        
         result = RecipeManager.run_recipe(
             name=args.run_recipe,
             variable_values=variable_values,
             headless=args.headless,
-            browser_type=args.browser
+            browser_type=args.browser,
+            trace=args.trace,
+            session=args.session_profile,
+            checkpoint=args.checkpoint,
+            resume=args.resume,
+            on_step=emit_step if args.jsonl else None,
+            max_payload=args.max_payload,
+            spill_dir=args.spill_dir,
+            **engine_options
         )
-        print(json.dumps(result.to_dict(), indent=2))
+        print(json.dumps(result.to_dict(), indent=None if args.jsonl else 2))
         sys.exit(0 if result.success else 1)
     
     # ===== ACCIONES BÁSICAS =====
@@ -939,27 +4137,7 @@ def main():
         parser.print_help()
         sys.exit(1)
     
-    # Inicializar controlador
-    controller = BrowserController(headless=args.headless, browser_type=args.browser)
-    
-    # Acciones que requieren navegador iniciado
-    actions_requiring_browser = [
-        "navigate", "click", "fill", "type", "press_key", "wait_for_selector",
-        "wait_for_load", "screenshot", "get_text", "get_html", "evaluate",
-        "scroll", "scroll_to_element", "select_option", "get_attribute",
-        "get_elements", "go_back", "go_forward", "reload", "set_viewport",
-        "new_tab", "close_tab", "switch_tab", "list_tabs", "handle_dialog",
-        "hover", "focus", "clear", "check", "sleep"
-    ]
-    
-    # Iniciar navegador si es necesario
-    if args.action in ["start"] + actions_requiring_browser:
-        result = controller.start()
-        if not result.success:
-            print(json.dumps(result.to_dict(), indent=2))
-            sys.exit(1)
-    
-    # Ejecutar acción
+    # Parámetros de la acción
     params = {
         "url": args.url,
         "selector": args.selector,
@@ -976,14 +4154,70 @@ def main():
         "timeout": args.timeout,
         "delay": args.delay,
         "full_page": args.full_page,
+        "path": args.output,
+        "dir": args.output_dir,
+        "format": args.format,
+        "quality": args.quality,
+        "clip": args.clip,
+        "fields": args.fields,
+        "limit": args.limit,
+        "offset": args.offset,
+        "schema": _load_json_arg(args.schema),
+        "next": args.next,
+        "max_pages": args.max_pages,
         "script": args.script,
         "state": args.value,
+        "wait_until": args.wait_until,
+        "ready_selector": args.ready_selector,
+        "ready_js": args.ready_js,
+        "dom_idle_ms": args.dom_idle,
+        "name": args.session_profile,
+        "reset": args.reset or None,
+        "wait_ms": args.wait_ms,
+        "idle_scrolls": args.idle_scrolls,
+        "time_budget": args.time_budget,
+        "ttl": args.session_ttl,
         "seconds": args.seconds,
         "checked": args.accept
     }
     # Eliminar parámetros None
     params = {k: v for k, v in params.items() if v is not None}
     
+    daemon_client = None if args.no_daemon else _connect_daemon(args.daemon_address)
+    if daemon_client:
+        response = daemon_client.request({
+            "session": args.session,
+            "action": args.action,
+            "params": _absolute_paths(params),
+            "headless": args.headless,
+            "browser": args.browser,
+            "options": engine_options
+        })
+        daemon_client.close()
+        print(json.dumps(response, indent=2))
+        sys.exit(0 if response.get("success") else 1)
+    
+    # Inicializar controlador
+    controller = BrowserController(headless=args.headless, browser_type=args.browser, **engine_options)
+    
+    # Acciones que requieren navegador iniciado
+    actions_requiring_browser = [
+        "navigate", "click", "fill", "type", "press_key", "wait_for_selector",
+        "wait_for_load", "screenshot", "get_text", "get_html", "evaluate",
+        "scroll", "scroll_to_element", "select_option", "get_attribute",
+        "get_elements", "extract", "harvest", "performance_metrics", "watch_dom", "recycle", "block_resources", "save_session", "load_session", "go_back", "go_forward", "reload", "set_viewport",
+        "new_tab", "close_tab", "switch_tab", "list_tabs", "handle_dialog",
+        "hover", "focus", "clear", "check", "sleep"
+    ]
+    
+    # Iniciar navegador si es necesario
+    if args.action in ["start"] + actions_requiring_browser:
+        result = controller.start()
+        if not result.success:
+            print(json.dumps(result.to_dict(), indent=2))
+            sys.exit(1)
+    
+    # Ejecutar acción
     result = controller.execute_action(args.action, params)
     
     # Imprimir resultado como JSON